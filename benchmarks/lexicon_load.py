@@ -0,0 +1,58 @@
+"""
+Compare the time to load a large PCCG lexicon from source against loading
+it from the on-disk cache.
+
+Usage::
+
+    $ python benchmarks/lexicon_load.py [--words N] [--repeat R]
+"""
+import argparse
+import os
+import tempfile
+import robiphora.ccg as ccg
+from robiphora.cache import DiskCache
+from robiphora.synth import name
+from timing import best_of
+
+ENTRIES = (
+    '{0}:=NP[1.0]:{0}()',
+    '{0}:=N[house 0.7]:{0}()',
+    '{0}:=NP/N:λx.{0}(x)',
+    '{0}:=(S\\NP)/NP[workshop 0.9, 0.5]:λy.λx.{0}(x,y)',
+    '{0}:=((S\\NP)/NP)/NP[house 0.6, 0.5]:λz.λy.λx.{0}(x,y,z)',
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--words', type=int, default=2000,
+                        help='number of distinct words in the lexicon')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timing runs (the best is reported)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.pccg')
+        with open(path, 'w') as f:
+            for n in range(args.words):
+                for entry in ENTRIES:
+                    print(entry.format(name('w', n)), file=f)
+        cache = DiskCache('pccg', directory=tmp)
+
+        def load(disk_cache):
+            with open(path) as f:
+                return ccg.load_lexicon(f, disk_cache=disk_cache)
+
+        cold, lexicon = best_of(args.repeat, lambda: load(None))
+        build, _ = best_of(1, lambda: load(cache))
+        cached, _ = best_of(args.repeat, lambda: load(cache))
+
+    print('{} definitions'.format(len(lexicon)))
+    print('cold load:    {:8.3f}s'.format(cold))
+    print('cache build:  {:8.3f}s'.format(build))
+    print('cached load:  {:8.3f}s ({:.1f}x faster)'.format(
+        cached, cold / cached))
+
+
+if __name__ == '__main__':
+    main()
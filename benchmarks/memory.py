@@ -0,0 +1,62 @@
+"""
+Measure the memory held by a large synthetic PCCG lexicon and by the chart
+of a long sentence parsed with it.
+
+Usage::
+
+    $ python benchmarks/memory.py [--words N] [--ambiguity A] [--length L]
+"""
+import argparse
+import random
+import tracemalloc
+import robiphora.ccg as ccg
+from robiphora.opdl import KnowledgeBase
+from robiphora import synth
+
+
+def measure(f):
+    """
+    Return the result of ``f()`` and the number of bytes it still holds.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = f()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--words', type=int, default=2000,
+                        help='number of words per part of speech')
+    parser.add_argument('--ambiguity', type=int, default=3,
+                        help='number of definitions per word')
+    parser.add_argument('--length', type=int, default=11,
+                        help='number of words in the parsed sentence')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for generating the workload')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    opdl, levels = synth.type_hierarchy(rng, 4, 3)
+    types = [t for level in levels for t in level]
+    kb = KnowledgeBase(opdl)
+    pccg, vocabulary = synth.lexicon(rng, args.words, args.ambiguity, types)
+    words = synth.sentence(rng, vocabulary, args.length)
+
+    lexicon, lexicon_bytes = measure(
+        lambda: ccg.Lexicon(ccg.parse(ccg.lex(pccg))))
+    chart, chart_bytes = measure(
+        lambda: ccg.fill_chart(words, lexicon, kb, rng.choice(types)))
+    items = sum(len(v) for cell in chart.values() for v in cell.values())
+
+    print('lexicon: {:10.1f} MiB for {} definitions ({:.0f} bytes each)'
+          .format(lexicon_bytes / 2**20, len(lexicon),
+                  lexicon_bytes / len(lexicon)))
+    print('chart:   {:10.1f} MiB for {} items ({:.0f} bytes each)'
+          .format(chart_bytes / 2**20, items, chart_bytes / items))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Time knowledge base loading, type queries, lexicon parsing and chart parsing
+on synthetic workloads of increasing size, optionally comparing against a
+stored baseline to catch changes in behaviour and performance.
+
+Usage::
+
+    $ pip install .
+    $ python benchmarks/suite.py --compare benchmarks/baseline.json
+
+(or run it from the top of the source tree with ``PYTHONPATH=.`` instead of
+installing).  ``benchmarks/baseline.json`` holds the small and medium
+results of the current tree, recorded without a machine so that only
+their checksums are compared; after a deliberate change in behaviour,
+update it with ``--save`` and clear its ``machine``.
+
+Workloads are generated from ``--seed``, and a checksum of each benchmark's
+results is stored alongside its time.  With ``--compare``, the exit status
+is 1 if any checksum differs from the baseline.  Times depend on the
+machine, so they are only compared if the baseline was saved on this one:
+then the exit status is also 1 if any benchmark is more than
+``--tolerance`` slower.  To check timings elsewhere, ``--save`` a baseline
+from the old tree first.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import robiphora.ccg as ccg
+from robiphora.opdl import KnowledgeBase
+from robiphora import synth
+from timing import best_of
+
+# Type hierarchy depth and branching, words per part of speech, definitions
+# per word, sentence length, and the number of queries and sentences timed.
+# query_is and chart parsing grow quickly, so larger sizes time fewer.
+SIZES = {
+    'small': dict(depth=3, branching=3, words=50, ambiguity=2, length=8,
+                  queries=1000, sentences=50),
+    'medium': dict(depth=4, branching=3, words=200, ambiguity=2, length=14,
+                   queries=200, sentences=20),
+    'large': dict(depth=5, branching=3, words=1000, ambiguity=3, length=11,
+                  queries=20, sentences=5),
+}
+
+
+def run(size, seed, repeat):
+    """
+    Return a dict of ``(seconds, checksum)`` for each benchmark at ``size``.
+    """
+    config = SIZES[size]
+    rng = random.Random(seed)
+    opdl, levels = synth.type_hierarchy(
+        rng, config['depth'], config['branching'])
+    types = [t for level in levels for t in level]
+    pccg, vocabulary = synth.lexicon(
+        rng, config['words'], config['ambiguity'], types)
+    pairs = [(rng.choice(types), rng.choice(types))
+             for _ in range(config['queries'])]
+    words = [synth.sentence(rng, vocabulary, config['length'])
+             for _ in range(config['sentences'])]
+    contexts = [rng.choice(types) for _ in range(config['sentences'])]
+    results = {}
+
+    t, kb = best_of(repeat, lambda: KnowledgeBase(opdl))
+    results['KnowledgeBase.load'] = (t, len(kb.types) + len(kb.objects))
+
+    def query():
+        kb.query_cache.clear()
+        return sum(kb.query_is(a, b) for a, b in pairs)
+
+    t, total = best_of(repeat, query)
+    results['query_is'] = (t, round(total, 6))
+
+    t, definitions = best_of(repeat,
+                             lambda: list(ccg.parse(ccg.lex(pccg))))
+    results['ccg.parse'] = (t, len(definitions))
+
+    def chartparse():
+        # A fresh lexicon, so every run computes its probability tables
+        kb.query_cache.clear()
+        lexicon = ccg.Lexicon(definitions)
+        return sum(len(ccg.chartparse(w, lexicon, kb, c) or ())
+                   for w, c in zip(words, contexts))
+
+    t, parses = best_of(repeat, chartparse)
+    results['chartparse'] = (t, parses)
+    return results
+
+
+def machine():
+    """
+    Return a description of this machine, to tell whether the timings of a
+    baseline are comparable.
+    """
+    return {'node': platform.node(), 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'python': platform.python_version()}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print each result against ``baseline`` and return whether any
+    benchmark's results differ from it, or, if it was saved on this
+    machine, whether any benchmark regressed by more than ``tolerance``.
+    """
+    timed = baseline.get('machine') == machine()
+    if not timed:
+        print('Baseline saved on another machine: only comparing results',
+              file=sys.stderr)
+    failed = False
+    for key, (t, checksum) in sorted(results.items()):
+        if key not in baseline['results']:
+            print('{:<32}{:>10.4f}s  (no baseline)'.format(key, t))
+            continue
+        base_t, base_checksum = baseline['results'][key]
+        ratio = t / base_t if base_t else float('inf')
+        note = ''
+        if timed and ratio > 1 + tolerance:
+            note = '  REGRESSION'
+            failed = True
+        if checksum != base_checksum:
+            note += '  (results differ: {} != {})'.format(
+                checksum, base_checksum)
+            failed = True
+        print('{:<32}{:>10.4f}s {:>10.4f}s {:>7.2f}x{}'.format(
+            key, t, base_t, ratio, note))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES),
+                        default=['small', 'medium'],
+                        help='workload sizes to run')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for generating the workloads')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timing runs (the best is reported)')
+    parser.add_argument('--save', metavar='json',
+                        help='store the results as a baseline in json')
+    parser.add_argument('--compare', metavar='json',
+                        help='compare the results against the baseline json')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction slower than a baseline saved on '
+                             'this machine which counts as a regression')
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        print('Running {} benchmarks...'.format(size), file=sys.stderr)
+        for key, value in run(size, args.seed, args.repeat).items():
+            results['{}/{}'.format(size, key)] = value
+
+    failed = False
+    if args.compare:
+        with open(args.compare) as f:
+            failed = compare(results, json.load(f), args.tolerance)
+    else:
+        for key, (t, checksum) in sorted(results.items()):
+            print('{:<32}{:>10.4f}s'.format(key, t))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': machine(), 'results': results}, f,
+                      indent=2, sort_keys=True)
+            f.write('\n')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+"""
+Timing helpers shared by the benchmark scripts, which import this module
+from their own directory.
+"""
+import time
+
+
+def best_of(repeat, f):
+    """
+    Call ``f()`` ``repeat`` times, returning the shortest time taken and
+    the result of the last call.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), result
@@ -1,13 +1,52 @@
 import argparse
+import atexit
 import readline
-import operator
 import sys
-import spacy
-from functools import reduce
+import json
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from robiphora.opdl import KnowledgeBase
+from robiphora.cache import DiskCache
+from robiphora import instrument
+from robiphora.nlp import (load_spacy, parse_words, resolve,
+                           resolution_record, parse_record)
 import robiphora.ccg as ccg
 
 
+def batch(args, kb, lexicon, nlp):
+    """
+    Resolve every line of ``args.batch`` with ``nlp.pipe``, writing one
+    JSON record per line (blank lines included) to standard output as the
+    input is read.
+    """
+    lines = (line.strip() for line in args.batch)
+    docs = instrument.timed_iter('spacy', nlp.pipe(
+        ((line, line) for line in lines), as_tuples=True,
+        batch_size=args.batch_size, n_process=args.n_process))
+    for doc, line in docs:
+        record = {'utterance': line,
+                  'noun_phrases': resolution_record(doc, kb, args.compile,
+                                                    args.top)}
+        if lexicon:
+            record['parses'] = parse_record(ccg.PARSERS[args.parser](
+                parse_words(line), lexicon, None, k=args.kbest))
+        print(json.dumps(record, ensure_ascii=False))
+
+
+def wait_for_spacy(nlp_future, name):
+    """
+    Return the spaCy model loaded by ``nlp_future``, or exit with an error
+    if it could not be loaded.
+    """
+    try:
+        return nlp_future.result()
+    except Exception as e:
+        print("Could not load spaCy model {!r}: {}".format(name, e),
+              file=sys.stderr)
+        sys.exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--pccg', metavar='g', type=argparse.FileType('r'),
@@ -20,19 +59,128 @@ def main():
             type=str,
             default='en_core_web_sm',
             help='spaCy model for tokenization')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use the on-disk cache of compiled '
+                             'PCCG and OPDL files')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='clear the on-disk cache before loading')
+    parser.add_argument('--import-workers', metavar='n', type=int,
+                        help='compile OPDL imports in n processes')
+    parser.add_argument('--compile', action='store_true',
+                        help='compile the type hierarchy into a NumPy '
+                             'matrix for faster noun phrase resolution')
+    parser.add_argument('--kbest', metavar='k', type=int, default=1,
+                        help='number of most probable parses to print')
+    parser.add_argument('--top', metavar='k', type=int,
+                        help='print only the k most probable objects for '
+                             'each noun phrase, most probable first')
+    parser.add_argument('--parser', choices=sorted(ccg.PARSERS),
+                        default='cky',
+                        help='PCCG parser: exhaustive CKY or best-first '
+                             'agenda parsing (default: cky)')
+    parser.add_argument('--casefold', action='store_true',
+                        help='match words to the PCCG lexicon '
+                             'case-insensitively')
+    parser.add_argument('--batch', metavar='f',
+                        type=argparse.FileType('r'),
+                        help='resolve each line of f (- for STDIN) and '
+                             'print the results as JSON lines instead of '
+                             'starting a REPL')
+    parser.add_argument('--batch-size', metavar='n', type=int, default=256,
+                        help='number of lines spaCy processes at once in '
+                             'batch mode')
+    parser.add_argument('--n-process', metavar='n', type=int, default=1,
+                        help='number of spaCy processes in batch mode')
+    parser.add_argument('--serve', action='store_true',
+                        help='serve JSON parse and resolve requests instead '
+                             'of starting a REPL (see robiphora.server)')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='address to serve on')
+    parser.add_argument('--port', type=int, default=8642,
+                        help='TCP port to serve on')
+    parser.add_argument('--socket', metavar='path', type=str,
+                        help='serve on a Unix socket instead of TCP')
+    parser.add_argument('--workers', metavar='n', type=int,
+                        help='number of parsing processes when serving '
+                             '(default: one per CPU)')
+    parser.add_argument('--profile', metavar='json', nargs='?', const='-',
+                        help='record timings and counters and print a '
+                             'summary to STDERR at exit, or write them to '
+                             'the file json')
     args = parser.parse_args()
+    if args.serve and args.profile:
+        # Parsing runs in worker processes, whose counters are never merged
+        parser.error('--profile cannot be combined with --serve')
+    if args.kbest < 1:
+        parser.error('--kbest must be at least 1')
+    if args.top is not None and args.top < 1:
+        parser.error('--top must be at least 1')
+    if args.compile:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            parser.error('--compile requires NumPy: pip install .[numpy]')
+    if args.profile:
+        instrument.enable()
+        atexit.register(instrument.dump, args.profile)
 
-    print("Welcome to Robiphora!")
-    print("Loading OPDL file {!r}...".format(args.opdl.name))
-    kb = KnowledgeBase(args.opdl)
+    # In batch mode standard output is kept for results
+    log = functools.partial(print, file=sys.stderr if args.batch
+                            else sys.stdout)
+    log("Welcome to Robiphora!")
+    # Load spaCy in the background while we load everything else
+    nlp_future = ThreadPoolExecutor(1).submit(load_spacy, args.spacy_model)
+    pccg_cache, opdl_cache = DiskCache('pccg'), DiskCache('opdl')
+    if args.clear_cache:
+        pccg_cache.clear()
+        opdl_cache.clear()
+    log("Loading OPDL file {!r}...".format(args.opdl.name))
+    if args.import_workers:
+        # Forking while spaCy loads on another thread risks a deadlock
+        with ProcessPoolExecutor(
+                args.import_workers,
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            kb = KnowledgeBase(
+                args.opdl,
+                disk_cache=None if args.no_cache else opdl_cache,
+                executor=executor)
+    else:
+        kb = KnowledgeBase(args.opdl,
+                           disk_cache=None if args.no_cache else opdl_cache)
+    if args.compile:
+        log("Compiling type hierarchy...")
+        kb.compile()
     if args.pccg:
-        print("Loading PCCG lexicon {!r}...".format(args.pccg.name))
-        lexicon = list(ccg.parse(ccg.lex(args.pccg.read())))
+        log("Loading PCCG lexicon {!r}...".format(args.pccg.name))
+        lexicon = ccg.load_lexicon(
+            args.pccg, casefold=args.casefold,
+            disk_cache=None if args.no_cache else pccg_cache)
     else:
         lexicon = None
-    nlp = spacy.load(args.spacy_model)
 
+    if args.batch:
+        nlp = wait_for_spacy(nlp_future, args.spacy_model)
+        batch(args, kb, lexicon, nlp)
+        return
+    if args.serve:
+        from robiphora.server import Server
+        # Rather than answer every resolve request with the same error, do
+        # not serve at all without a model
+        if not nlp_future.done():
+            log("Waiting for spaCy model {!r}...".format(args.spacy_model))
+        nlp = wait_for_spacy(nlp_future, args.spacy_model)
+        log("Serving on {}...".format(
+            args.socket or '{}:{}'.format(args.host, args.port)))
+        Server(kb, lexicon, nlp, args.workers, args.compile).run(
+            args.host, args.port, args.socket)
+        return
+
+    nlp = None
     while True:
+        # Only the first query waits for the model, but a model which has
+        # already failed to load is reported before the next prompt
+        if nlp is None and nlp_future.done():
+            nlp = wait_for_spacy(nlp_future, args.spacy_model)
         try:
             line = input('ρ> ')
         except EOFError:
@@ -42,25 +190,27 @@ def main():
             print()
             continue
         if lexicon:
-            words = line.replace(',', '').replace('.', '').split()
-            parses = ccg.chartparse(words, lexicon, None)
-            for parse in parses:
-                print(parses[0][1])
+            parses = ccg.PARSERS[args.parser](
+                parse_words(line), lexicon, None, k=args.kbest)
+            for _, production, _ in parses:
+                print(production)
+
+        if nlp is None:
+            if not nlp_future.done():
+                print("Waiting for spaCy model {!r}...".format(
+                    args.spacy_model))
+            nlp = wait_for_spacy(nlp_future, args.spacy_model)
 
-        doc = nlp(line)
-        noun_phrases = list(doc.noun_chunks)
-        for np in noun_phrases:
-            baseset = set()
-            for tok in np:
-                toktyp = spacy.explain(tok.pos_) + 's'
-                baseset |= kb.baserefs[toktyp][tok.text.casefold()]
-            if not baseset:
+        with instrument.timed('spacy'):
+            doc = nlp(line)
+        for np, scores in resolve(doc, kb, args.compile, args.top):
+            if scores is None:
                 print('No known base types for phrase "{}"'.format(np))
                 continue
-            for obj in kb.objects.values():
-                p = reduce(
-                    operator.mul,
-                    (max(kb.query_is(t, b) for t in obj.types)
-                        for b in baseset))
+            for obj, p in scores:
                 print("{} -> (object {!r}): {}".format(np, obj.name, p))
 
+
+if __name__ == '__main__':
+    main()
+
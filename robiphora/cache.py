@@ -0,0 +1,96 @@
+"""
+On-Disk Caches
+==============
+
+Utilities for keeping data compiled from source files (such as OPDL
+knowledge bases and PCCG lexicons) between runs.
+"""
+import os
+import pickle
+import hashlib
+import shutil
+from robiphora import __version__
+
+# Bumped when the layout of cached objects changes, such as their slots
+FORMAT = 2
+
+
+def default_directory():
+    """
+    Return ``$ROBIPHORA_CACHE_DIR`` if set, otherwise ``robiphora`` under
+    ``$XDG_CACHE_HOME`` (or ``~/.cache``).
+    """
+    if os.environ.get('ROBIPHORA_CACHE_DIR'):
+        return os.environ['ROBIPHORA_CACHE_DIR']
+    base = (os.environ.get('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'robiphora')
+
+
+class DiskCache:
+    """
+    A directory of pickled data compiled from source files.  Each entry is
+    stamped with the modification time and size of its source file, and is
+    rebuilt when they change.
+    """
+    def __init__(self, namespace, directory=None):
+        if directory is None:
+            directory = default_directory()
+        self.directory = os.path.join(directory, namespace)
+
+    def __repr__(self):
+        return 'DiskCache({!r})'.format(self.directory)
+
+    def entry(self, source):
+        """
+        Return the path of the cache entry for the file ``source``.
+        """
+        digest = hashlib.sha1(
+            os.path.realpath(source).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.pickle')
+
+    @staticmethod
+    def stamp(source):
+        st = os.stat(source)
+        return (__version__, FORMAT, st.st_mtime_ns, st.st_size)
+
+    def get(self, source, build):
+        """
+        Return the cached data for the file ``source``, calling ``build()``
+        to compile it if there is no up to date entry.
+        """
+        stamp = self.stamp(source)
+        entry = self.entry(source)
+        try:
+            with open(entry, 'rb') as f:
+                if pickle.load(f) == stamp:
+                    return pickle.load(f)
+        except Exception:
+            # A stale or unreadable entry (even one naming classes which no
+            # longer exist) is just a miss
+            pass
+        data = build()
+        self.put(entry, stamp, data)
+        return data
+
+    def put(self, entry, stamp, data):
+        # Write to a temporary file first so that concurrent readers never
+        # see a partial entry.  A cache we cannot write is not an error.
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                pickle.dump(stamp, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, entry)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def clear(self):
+        """
+        Remove every entry in this cache.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,6 +1,13 @@
+import os
 import re
+import json
+import math
+import heapq
+import operator
 from itertools import chain
 from robiphora.opdl import match, KnowledgeBase
+from robiphora.cache import DiskCache
+from robiphora import instrument
 from collections import defaultdict
 
 
@@ -8,6 +15,8 @@ class ControlToken:
     """
     Base class for all control tokens.
     """
+    __slots__ = ()
+
     def __repr__(self):
         return self.__class__.__name__
 
@@ -19,10 +28,12 @@ T = {
 
 
 class Production:
-    pass
+    __slots__ = ()
 
 
 class Name(str, Production):
+    __slots__ = ()
+
     def __repr__(self):
         return self
 
@@ -33,21 +44,35 @@ class Name(str, Production):
 
 
 class Type:
+    __slots__ = ('name', '_hash')
+
     def __init__(self, name):
         if not isinstance(name, str):
             raise TypeError("Name of Type must be a str")
         self.name = name
+        self._hash = hash((self.__class__, name))
 
     def __repr__(self):
         return self.name
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, self.__class__):
             return self.name == other.name
         return False
 
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        # String hashes differ between processes, so rebuild on unpickle
+        return (self.__class__, (self.name, ))
+
 
 class TypeMissing(Type):
+    __slots__ = ('missing', )
+
     def __init__(self, lhs, missing):
         if not isinstance(lhs, Type):
             raise TypeError("LHS of TypeMissing MUST be a Type")
@@ -55,6 +80,7 @@ class TypeMissing(Type):
             raise TypeError("RHS of TypeMissing MUST be a Type")
         self.name = lhs
         self.missing = missing
+        self._hash = hash((self.__class__, lhs, missing))
 
     def __repr__(self):
         if isinstance(self.missing, TypeMissing):
@@ -64,20 +90,50 @@ class TypeMissing(Type):
         return f.format(self.name, self.op, self.missing)
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, self.__class__):
             return self.name == other.name and self.missing == other.missing
         return False
 
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (self.__class__, (self.name, self.missing))
+
 
 class TypeMissingLeft(TypeMissing):
+    __slots__ = ()
     op = '\\'
 
 
 class TypeMissingRight(TypeMissing):
+    __slots__ = ()
     op = '/'
 
 
+_interned_types = {}
+
+
+def intern_type(typ):
+    """
+    Return the canonical instance of the category ``typ``, so that equal
+    categories are the same object and compare in constant time.
+    """
+    if isinstance(typ, TypeMissing):
+        lhs, missing = intern_type(typ.name), intern_type(typ.missing)
+        if lhs is not typ.name or missing is not typ.missing:
+            typ = typ.__class__(lhs, missing)
+    return _interned_types.setdefault(typ, typ)
+
+
+S = intern_type(Type("S"))
+
+
 class Abstraction(Production):
+    __slots__ = ('var', 'prod')
+
     def __init__(self, var, prod):
         if not isinstance(prod, Production):
             raise TypeError("prod must be a Production")
@@ -99,6 +155,8 @@ class Abstraction(Production):
 
 
 class Predicate(Production):
+    __slots__ = ('name', 'args')
+
     def __init__(self, name, *args):
         self.name = name
         self.args = args
@@ -113,6 +171,8 @@ class Predicate(Production):
 
 
 class And(Production):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs, rhs):
         self.lhs = lhs
         self.rhs = rhs
@@ -125,6 +185,8 @@ class And(Production):
 
 
 class Definition:
+    __slots__ = ('word', 'typ', 'production', 'probdict', 'defaultprob')
+
     def __init__(self, word, typ, production, probdict=None, defaultprob=0.05):
         if probdict is None:
             probdict = {}
@@ -166,6 +228,8 @@ class Definition:
         with respect to the :class:`KnowledgeBase` ``kb`` of this definiton's
         production being the correct production.
         """
+        if instrument.enabled:
+            instrument.count('probability.calls')
         if context is None:
             return 1.0
         alpha = self.defaultprob
@@ -177,16 +241,22 @@ class Definition:
 
 
 class PartialPredicate(list):
+    __slots__ = ()
+
     def __repr__(self):
         return 'PartialPredicate({})'.format(super().__repr__())
 
 
 class DefaultProbability(float):
+    __slots__ = ()
+
     def __repr__(self):
         return 'DefaultProbability({})'.format(super().__repr__())
 
 
 class ProbabilityRelation(dict):
+    __slots__ = ()
+
     def __repr__(self):
         return 'ProbabilityRelation({})'.format(super().__repr__())
 
@@ -214,6 +284,9 @@ tokens_p = re.compile(r'''
 
 def lex(code):
     last_end = 0
+    # Names repeat throughout a lexicon (variables, contexts, predicates),
+    # so share one instance of each
+    names = {}
     for m in tokens_p.finditer(code):
         if m.start() != last_end:
             raise SyntaxError("malformed input")
@@ -223,7 +296,11 @@ def lex(code):
             assert len(keyset) == 1 or print(keyset)
             yield T[keyset.pop()]()
         elif m.group('name'):
-            yield Name(m.group('name'))
+            text = m.group('name')
+            name = names.get(text)
+            if name is None:
+                name = names[text] = Name(text)
+            yield name
         elif m.group('number'):
             yield float(m.group('number'))
         last_end = m.end()
@@ -354,45 +431,470 @@ def parse(tokens, debug=False):
         raise SyntaxError("incomplete parse")
 
 
-# Try to combine type1 and type2 (type2immedeatly to the right of type1)
-# Return Type is able to be combined
-#       False otherwise
-def combine(left, right):
-    if isinstance(left[0], TypeMissingRight):
-        if(left[0].missing == right[0]):
-            return (left[0].name, left[1].apply(right[1]), left[2] * right[2])
-    if isinstance(right[0], TypeMissingLeft):
-        if(right[0].missing == left[0]):
-            return (right[0].name, right[1].apply(left[1]), left[2] * right[2])
-    return False
+class ChartItem:
+    """
+    A derivation in the chart of category ``typ`` with probability
+    ``prob``, also kept as ``logprob`` so that long derivations can be
+    ranked without underflow.  Lexical items hold their ``definition``;
+    other items hold the ``functor`` and ``argument`` items they were built
+    from.
+
+    Semantics are only built when :meth:`production` is called, so chart
+    construction does not allocate lambda terms for derivations which never
+    become part of a parse.
+    """
+    __slots__ = ('typ', 'prob', 'logprob', 'definition', 'functor',
+                 'argument', '_production')
+
+    def __init__(self, typ, prob, definition=None, functor=None,
+                 argument=None, logprob=None):
+        self.typ = typ
+        self.prob = prob
+        if logprob is None:
+            logprob = math.log(prob) if prob > 0 else -math.inf
+        self.logprob = logprob
+        self.definition = definition
+        self.functor = functor
+        self.argument = argument
+        self._production = None
+
+    def __repr__(self):
+        return 'ChartItem({!r}, {!r})'.format(self.typ, self.prob)
+
+    def production(self):
+        """
+        Build (and remember) the semantics of this derivation.
+        """
+        if self._production is None:
+            if self.definition is not None:
+                self._production = self.definition.production
+            else:
+                self._production = self.functor.production().apply(
+                    self.argument.production())
+        return self._production
+
+    def as_tuple(self):
+        return (self.typ, self.production(), self.prob)
+
+
+def forward_apply(left, right):
+    """
+    Combine the :class:`ChartItem` ``left``, of category X/Y, with
+    ``right``, of category Y.
+    """
+    return ChartItem(left.typ.name, left.prob * right.prob,
+                     functor=left, argument=right,
+                     logprob=left.logprob + right.logprob)
+
+
+def backward_apply(left, right):
+    """
+    Combine the :class:`ChartItem` ``left``, of category Y, with ``right``,
+    of category X\\Y.
+    """
+    return ChartItem(right.typ.name, left.prob * right.prob,
+                     functor=right, argument=left,
+                     logprob=left.logprob + right.logprob)
+
+
+class Lexicon:
+    """
+    A collection of :class:`Definition` objects indexed by word.  If
+    ``casefold`` is true, words are looked up case-insensitively.
+
+    The probability of every definition in a context is computed once, the
+    first time the context is seen, and kept in a table until the lexicon
+    or the knowledge base changes.
+    """
+    def __init__(self, definitions=(), casefold=False):
+        self.casefold = casefold
+        self.index = {}
+        self._tables = {}
+        self._tables_kb = None
+        self._tables_generation = None
+        for d in definitions:
+            self.add(d)
+
+    def __iter__(self):
+        for definitions in self.index.values():
+            yield from definitions
+
+    def __len__(self):
+        return sum(map(len, self.index.values()))
+
+    def __repr__(self):
+        return 'Lexicon({!r})'.format(list(self))
+
+    def key(self, word):
+        return word.casefold() if self.casefold else word
+
+    def add(self, definition):
+        if not isinstance(definition, Definition):
+            raise TypeError("definition is not a Definition")
+        definition.typ = intern_type(definition.typ)
+        self.index.setdefault(self.key(definition.word), []).append(
+            definition)
+        self._tables.clear()
+
+    def remove(self, definition):
+        """
+        Remove ``definition``.  Raises :class:`ValueError` if it is not in
+        the lexicon.
+        """
+        key = self.key(definition.word)
+        definitions = self.index.get(key, [])
+        definitions.remove(definition)
+        if not definitions:
+            del self.index[key]
+        self._tables.clear()
+
+    def lookup(self, word):
+        """
+        Return the list of definitions for ``word``.
+        """
+        return self.index.get(self.key(word), [])
+
+    def table(self, context, kb):
+        """
+        Return a dict mapping each word (as given by :meth:`key`) to the
+        list of ``(definition, probability)`` pairs of its definitions in
+        ``context`` with respect to ``kb``.
+        """
+        generation = getattr(kb, 'generation', None)
+        if kb is not self._tables_kb or generation != self._tables_generation:
+            self._tables.clear()
+            self._tables_kb = kb
+            self._tables_generation = generation
+        try:
+            return self._tables[context]
+        except KeyError:
+            pass
+        if instrument.enabled:
+            instrument.count('lexicon.tables')
+        table = self._tables[context] = {
+            key: [(d, d.probability(context, kb)) for d in definitions]
+            for key, definitions in self.index.items()}
+        return table
+
+    def lookup_scored(self, word, context, kb):
+        """
+        Return the list of ``(definition, probability)`` pairs for ``word``
+        in ``context`` with respect to ``kb``.
+        """
+        if context is None:
+            return [(d, 1.0) for d in self.lookup(word)]
+        return self.table(context, kb).get(self.key(word), [])
+
+
+def load_lexicon(code, casefold=False, disk_cache=None):
+    """
+    Load a :class:`Lexicon` from the PCCG ``code``, a string or file.  If a
+    :class:`~robiphora.cache.DiskCache` is given, the parsed definitions of
+    a regular file are kept there and reused until the file changes.
+    """
+    def definitions(code):
+        return instrument.timed_iter('ccg.parse', parse(lex(code)))
+
+    with instrument.timed('ccg.load_lexicon'):
+        if (disk_cache is not None and hasattr(code, "name")
+                and os.path.isfile(code.name)):
+            defs = disk_cache.get(
+                code.name, lambda: list(definitions(code.read())))
+        else:
+            if hasattr(code, "read"):
+                code = code.read()
+            defs = definitions(code)
+        return Lexicon(defs, casefold=casefold)
 
 
 def find_word_in_lexicon(word, lexicon):
+    if isinstance(lexicon, Lexicon):
+        return lexicon.lookup(word)
     return [d for d in lexicon if d.word == word]
 
 
-def chartparse(words, lexicon, kb, context=None, verbose=False):
-    chart = defaultdict(list)
+def prune(cell, beam=None, threshold=None):
+    """
+    Prune the chart ``cell`` in place, keeping at most ``beam`` items of
+    each category and dropping items less probable than ``threshold``
+    times the most probable item in the cell.
+    """
+    if threshold is not None:
+        cutoff = threshold * max(
+            item.prob for items in cell.values() for item in items)
+    for typ in list(cell.keys()):
+        items = cell[typ]
+        if threshold is not None:
+            items = [item for item in items if item.prob >= cutoff]
+        if beam is not None and len(items) > beam:
+            items = heapq.nlargest(beam, items,
+                                   key=operator.attrgetter('prob'))
+        if items:
+            cell[typ] = items
+        else:
+            del cell[typ]
+
+
+def fill_chart(words, lexicon, kb, context=None, beam=None, threshold=None):
+    """
+    Fill and return the CKY chart for the list of ``words``.  The chart
+    maps each ``(start, length)`` span to a cell, which maps a category to
+    the list of :class:`ChartItem` objects of that category, so each
+    functor is only tried against arguments of matching category.
+
+    ``lexicon`` is a :class:`Lexicon` or an iterable of :class:`Definition`
+    objects.  If ``beam`` or ``threshold`` is given, each cell is pruned
+    with :func:`prune` once it is filled, which bounds the work done on
+    long or highly ambiguous sentences at the cost of possibly missing
+    parses.
+    """
+    with instrument.timed('chartparse'):
+        return _fill_chart(words, lexicon, kb, context, beam, threshold)
+
+
+def _check_pruning(beam, threshold):
+    if beam is not None and beam < 1:
+        raise ValueError("beam must be at least 1")
+    if threshold is not None and not 0.0 <= threshold <= 1.0:
+        raise ValueError("threshold must be between 0 and 1")
+
+
+def _fill_chart(words, lexicon, kb, context, beam, threshold):
+    _check_pruning(beam, threshold)
+    chart = {}
+    if not isinstance(lexicon, Lexicon):
+        lexicon = Lexicon(lexicon)
 
     for index, word in enumerate(words):
-        for d in find_word_in_lexicon(word, lexicon):
-            chart[(index, 1)].append(
-                (d.typ, d.production, d.probability(context, kb)))
-
-    for j in range(2, len(words)+1):
-        for i in range(0, len(words)-j+1):
-            for k in range(1, j):
-
-                for l in chart[(i, k)]:
-                    for r in chart[(i+k, j-k)]:
-                        c = combine(l, r)
-                        if c:
-                            chart[(i, j)].append(c)
-    if chart[(0, len(words))]:
-        parses = []
-        for p in chart[(0, len(words))]:
-            if p[0] == Type("S"):
-                parses.append(p)
+        _fill_lexical_cell(chart, index, word, lexicon, kb, context,
+                           beam, threshold)
+    _fill_spans(chart, len(words), beam, threshold)
+    return chart
+
+
+def _fill_lexical_cell(chart, i, word, lexicon, kb, context, beam=None,
+                       threshold=None):
+    cell = chart[(i, 1)] = {}
+    for d, p in lexicon.lookup_scored(word, context, kb):
+        cell.setdefault(d.typ, []).append(ChartItem(d.typ, p, definition=d))
+    if (beam is not None or threshold is not None) and cell:
+        prune(cell, beam, threshold)
+
+
+def _fill_spans(chart, n, beam=None, threshold=None):
+    # Fill the cells spanning more than one of the n words from the
+    # lexical cells already in the chart
+    for j in range(2, n+1):
+        for i in range(0, n-j+1):
+            _fill_cell(chart, i, j, beam, threshold)
+
+
+def _fill_cell(chart, i, j, beam=None, threshold=None):
+    # Fill the cell of the j words starting at word i from the shorter
+    # cells already in the chart
+    cell = chart[(i, j)] = {}
+    for k in range(1, j):
+        left = chart[(i, k)]
+        right = chart[(i+k, j-k)]
+        if not left or not right:
+            continue
+        if instrument.enabled:
+            instrument.count(
+                'combine.candidates',
+                sum(map(len, left.values()))
+                * sum(map(len, right.values())))
+
+        for typ, ls in left.items():
+            if isinstance(typ, TypeMissingRight):
+                for r in right.get(typ.missing, ()):
+                    for l in ls:
+                        c = forward_apply(l, r)
+                        cell.setdefault(c.typ, []).append(c)
+        for typ, rs in right.items():
+            if isinstance(typ, TypeMissingLeft):
+                for l in left.get(typ.missing, ()):
+                    for r in rs:
+                        c = backward_apply(l, r)
+                        cell.setdefault(c.typ, []).append(c)
+    if instrument.enabled:
+        size = sum(map(len, cell.values()))
+        instrument.count('combine.successes', size)
+        instrument.count('chart.items', size)
+        instrument.maximum('chart.cell_size', size)
+    if (beam is not None or threshold is not None) and cell:
+        prune(cell, beam, threshold)
+
+
+def fill_chart_contexts(words, lexicon, kb, contexts):
+    """
+    Fill a chart for the list of ``words`` in every one of the list of
+    ``contexts`` at once.  The chart is as for :func:`fill_chart`, except
+    that the ``prob`` and ``logprob`` of each item are NumPy arrays with an
+    entry for each context, so the derivations are only built once.
+    Requires NumPy.
+    """
+    import numpy as np
+    if not isinstance(lexicon, Lexicon):
+        lexicon = Lexicon(lexicon)
+    contexts = list(contexts)
+    with instrument.timed('chartparse'):
+        chart = {}
+        for index, word in enumerate(words):
+            cell = chart[(index, 1)] = {}
+            columns = [lexicon.lookup_scored(word, c, kb) for c in contexts]
+            for n, d in enumerate(lexicon.lookup(word)):
+                prob = np.array([column[n][1] for column in columns])
+                with np.errstate(divide='ignore'):
+                    logprob = np.log(prob)
+                cell.setdefault(d.typ, []).append(
+                    ChartItem(d.typ, prob, definition=d, logprob=logprob))
+        _fill_spans(chart, len(words))
+    return chart
+
+
+def chartparse_contexts(words, lexicon, kb, contexts):
+    """
+    Parse the list of ``words`` in each of ``contexts`` with a single
+    :func:`fill_chart_contexts`.  Returns the list of ``(category,
+    production, probabilities)`` tuples for every ``S`` derivation spanning
+    the whole sentence, where ``probabilities`` maps each context to the
+    probability of the derivation in it, or ``False`` if nothing spans the
+    sentence.  Requires NumPy.
+    """
+    contexts = list(contexts)
+    chart = fill_chart_contexts(words, lexicon, kb, contexts)
+    items = chart.get((0, len(words)), {}).get(S)
+    if not items:
+        return False
+    return [(item.typ, item.production(),
+             dict(zip(contexts, map(float, item.prob))))
+            for item in items]
+
+
+def best_parses(parses):
+    """
+    Return a dict mapping each context to the ``(production,
+    probability)`` of the most probable of the ``parses`` from
+    :func:`chartparse_contexts` in that context.  Ties go to the first
+    parse.
+    """
+    best = {}
+    for _, production, probabilities in parses:
+        for context, p in probabilities.items():
+            if context not in best or p > best[context][1]:
+                best[context] = (production, p)
+    return best
+
+
+def context_distribution(probabilities):
+    """
+    Normalize the ``probabilities`` of one parse from
+    :func:`chartparse_contexts` into a distribution over its contexts,
+    taking every context to be equally likely beforehand.
+    """
+    total = sum(probabilities.values())
+    if not total:
+        return {context: 0.0 for context in probabilities}
+    return {context: p / total for context, p in probabilities.items()}
+
+
+class IncrementalParser:
+    """
+    A chart parser for words which arrive one at a time, such as the
+    output of speech recognition.  Each word given to :meth:`feed` only
+    fills the cells ending at that word, so the work per word depends on
+    the length of the sentence so far rather than on reparsing it.
+    Arguments are as for :func:`fill_chart`.
+    """
+    def __init__(self, lexicon, kb, context=None, beam=None,
+                 threshold=None):
+        _check_pruning(beam, threshold)
+        if not isinstance(lexicon, Lexicon):
+            lexicon = Lexicon(lexicon)
+        self.lexicon = lexicon
+        self.kb = kb
+        self.context = context
+        self.beam = beam
+        self.threshold = threshold
+        self.reset()
+
+    def __repr__(self):
+        return 'IncrementalParser({!r})'.format(self.words)
+
+    def reset(self):
+        """
+        Start a new sentence.
+        """
+        self.words = []
+        self.chart = {}
+        # The best analysis of the first n words as a sequence of spans,
+        # as (number of spans, -log probability, spans)
+        self._segmentations = [(0, 0.0, ())]
+
+    def feed(self, word):
+        """
+        Add ``word`` to the end of the sentence.
+        """
+        with instrument.timed('chartparse'):
+            n = len(self.words)
+            self.words.append(word)
+            _fill_lexical_cell(self.chart, n, word, self.lexicon, self.kb,
+                               self.context, self.beam, self.threshold)
+            for i in range(n - 1, -1, -1):
+                _fill_cell(self.chart, i, n + 1 - i, self.beam,
+                           self.threshold)
+            best = None
+            for i in range(n + 1):
+                cell = self.chart[(i, n + 1 - i)]
+                if not cell or self._segmentations[i] is None:
+                    continue
+                item = max((item for items in cell.values()
+                            for item in items),
+                           key=operator.attrgetter('logprob'))
+                count, cost, spans = self._segmentations[i]
+                candidate = (count + 1, cost - item.logprob,
+                             spans + ((i, n + 1 - i, item), ))
+                if best is None or candidate[:2] < best[:2]:
+                    best = candidate
+            self._segmentations.append(best)
+
+    def parses(self):
+        """
+        Return the list of ``(category, production, probability)`` tuples
+        for every ``S`` derivation of the words so far, as for
+        :func:`chartparse`, or an empty list if there are none yet.
+        """
+        items = self.chart.get((0, len(self.words)), {}).get(S, [])
+        return [item.as_tuple() for item in items]
+
+    def best_spans(self):
+        """
+        Return the best partial analysis of the words so far: the fewest
+        chart items which cover them, most probable first among equals, as
+        a list of ``(start, length, category, production, probability)``
+        tuples in order, or an empty list if some word so far has no
+        definition.
+        """
+        best = self._segmentations[-1]
+        if best is None:
+            return []
+        return [(i, length) + item.as_tuple()
+                for i, length, item in best[2]]
+
+
+def chartparse(words, lexicon, kb, context=None, verbose=False,
+               beam=None, threshold=None):
+    """
+    Parse the list of ``words`` using :func:`fill_chart`.  Returns the list
+    of ``(category, production, probability)`` tuples for every ``S``
+    derivation spanning the whole sentence, in no particular order, or
+    ``False`` if nothing spans the sentence.  Semantics are only built for
+    the returned derivations.
+    """
+    chart = fill_chart(words, lexicon, kb, context, beam, threshold)
+    if chart.get((0, len(words))):
+        parses = [item.as_tuple()
+                  for item in chart[(0, len(words))].get(S, [])]
         if verbose:
             print("{} => {}".format(" ".join(words), parses))
         return parses
@@ -402,8 +904,182 @@ def chartparse(words, lexicon, kb, context=None, verbose=False):
         return False
 
 
+def kbest(words, lexicon, kb, context=None, k=None, beam=None,
+          threshold=None):
+    """
+    Yield at most ``k`` (or all, if ``k`` is ``None``) parses of the list
+    of ``words`` in descending order of probability, as ``(category,
+    production, log probability)`` tuples.  Arguments are as for
+    :func:`fill_chart`.
+
+    Parses are popped from a heap one at a time, so only the semantics of
+    the parses actually consumed are built.
+    """
+    chart = fill_chart(words, lexicon, kb, context, beam, threshold)
+    heap = [(-item.logprob, n, item)
+            for n, item in enumerate(
+                chart.get((0, len(words)), {}).get(S, []))]
+    heapq.heapify(heap)
+    while heap and (k is None or k > 0):
+        _, _, item = heapq.heappop(heap)
+        yield (item.typ, item.production(), item.logprob)
+        if k is not None:
+            k -= 1
+
+
+def agenda_kbest(words, lexicon, kb, context=None, k=None):
+    """
+    Yield at most ``k`` (or all, if ``k`` is ``None``) parses of the list
+    of ``words`` in descending order of probability, like :func:`kbest`,
+    but found with an agenda parser instead of filling the whole chart.
+
+    Items are taken from the agenda best first, ranked by their probability
+    times an upper bound on the rest of the sentence: the product of the
+    best lexical probability of each word outside the item, as the
+    probability of a derivation is the product of its lexical items.  Only
+    items which have been taken are combined, so empty and hopeless spans
+    are never visited, and the best parse is found as soon as nothing left
+    on the agenda can beat it.  Equally probable parses may come in a
+    different order than from :func:`kbest`.
+    """
+    if not isinstance(lexicon, Lexicon):
+        lexicon = Lexicon(lexicon)
+    n = len(words)
+    agenda = []
+    counter = 0
+    # The best log probability of each word, and the bound outside spans
+    best = []
+    for i, word in enumerate(words):
+        scored = lexicon.lookup_scored(word, context, kb)
+        if not scored:
+            return
+        best.append(max(ChartItem(d.typ, p).logprob for d, p in scored))
+    prefix = [0.0]
+    for logprob in best:
+        prefix.append(prefix[-1] + logprob)
+    # Slack so that rounding never makes the bound inadmissible
+    slack = 1e-9 * (n + 1)
+
+    def push(i, j, item):
+        nonlocal counter
+        if i == 0 and j == n:
+            if item.typ == S:
+                heapq.heappush(found, (-item.logprob, counter, item))
+                counter += 1
+            return
+        bound = item.logprob + prefix[n] - prefix[j] + prefix[i] + slack
+        heapq.heappush(agenda, (-bound, counter, i, j, item))
+        counter += 1
+
+    found = []
+    with instrument.timed('chartparse'):
+        for i, word in enumerate(words):
+            for d, p in lexicon.lookup_scored(word, context, kb):
+                push(i, i + 1, ChartItem(d.typ, p, definition=d))
+    # Items taken from the agenda, by the position they start and end at
+    starts = defaultdict(lambda: defaultdict(list))
+    ends = defaultdict(lambda: defaultdict(list))
+    while k is None or k > 0:
+        with instrument.timed('chartparse'):
+            while agenda and (not found or -agenda[0][0] > -found[0][0]):
+                _, _, i, j, item = heapq.heappop(agenda)
+                if instrument.enabled:
+                    instrument.count('agenda.pops')
+                typ = item.typ
+                for ltyp, ls in ends[i].items():
+                    if isinstance(ltyp, TypeMissingRight) and \
+                            ltyp.missing == typ:
+                        for l in ls:
+                            push(i - l[0], j, forward_apply(l[1], item))
+                    if isinstance(typ, TypeMissingLeft) and \
+                            typ.missing == ltyp:
+                        for l in ls:
+                            push(i - l[0], j, backward_apply(l[1], item))
+                for rtyp, rs in starts[j].items():
+                    if isinstance(typ, TypeMissingRight) and \
+                            typ.missing == rtyp:
+                        for r in rs:
+                            push(i, j + r[0], forward_apply(item, r[1]))
+                    if isinstance(rtyp, TypeMissingLeft) and \
+                            rtyp.missing == typ:
+                        for r in rs:
+                            push(i, j + r[0], backward_apply(item, r[1]))
+                starts[i][typ].append((j - i, item))
+                ends[j][typ].append((j - i, item))
+        if not found:
+            return
+        _, _, item = heapq.heappop(found)
+        yield (item.typ, item.production(), item.logprob)
+        if k is not None:
+            k -= 1
+
+
+# k-best parsers by name, for selecting one from the command line
+PARSERS = {'cky': kbest, 'agenda': agenda_kbest}
+
+
+# The lexicon, knowledge base and options of a batch_parse worker process
+_batch_state = None
+
+
+def _init_batch_worker(lexicon, kb, context, beam, threshold):
+    global _batch_state
+    _batch_state = (lexicon, kb, context, beam, threshold)
+
+
+def _batch_record(line):
+    lexicon, kb, context, beam, threshold = _batch_state
+    record = {'line': line.rstrip('\n')}
+    try:
+        parses = chartparse(line.split(), lexicon, kb, context,
+                            beam=beam, threshold=threshold)
+    except Exception as e:
+        record['error'] = '{}: {}'.format(e.__class__.__name__, e)
+    else:
+        record['parses'] = None if parses is False else [
+            {'category': repr(typ), 'semantics': repr(production),
+             'probability': float(prob)}
+            for typ, production, prob in parses]
+    return json.dumps(record, ensure_ascii=False)
+
+
+def batch_parse(lines, lexicon, kb, context=None, beam=None,
+                threshold=None, jobs=1, chunk_size=64):
+    """
+    Parse each of ``lines`` with :func:`chartparse`, yielding a JSON record
+    for each, in order, with the ``line``, and either its ``parses`` (null
+    if nothing spans the line) or the ``error`` it raised.
+
+    With more than one of ``jobs``, lines are sent in chunks of
+    ``chunk_size`` to a pool of worker processes.  Where possible the
+    workers are forked, so they share the lexicon and knowledge base with
+    this process rather than each receiving a copy.
+    """
+    import multiprocessing
+    if not isinstance(lexicon, Lexicon):
+        lexicon = Lexicon(lexicon)
+    initargs = (lexicon, kb, context, beam, threshold)
+    if jobs == 1:
+        _init_batch_worker(*initargs)
+        yield from map(_batch_record, lines)
+        return
+    if context is not None:
+        # Fill the probability table, and the query cache behind it, before
+        # forking, so that the workers share it instead of each filling
+        # their own
+        lexicon.table(context, kb)
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except ValueError:
+        ctx = multiprocessing.get_context()
+    with ctx.Pool(jobs, initializer=_init_batch_worker,
+                  initargs=initargs) as pool:
+        yield from pool.imap(_batch_record, lines, chunk_size)
+
+
 def main():
     import argparse
+    import atexit
     import sys
 
     description = 'A PCCG parser that is context aware!'
@@ -414,18 +1090,112 @@ def main():
                         help='path to OPDL knowledgebase')
     parser.add_argument('--context', metavar='c', type=str,
                         help='current context (should be an OPDL type)')
-    parser.add_argument('--infile', metavar='i', type=str,
+    parser.add_argument('--contexts', metavar='c', type=str, nargs='+',
+                        help='parse in each of these contexts at once and '
+                             'print the best parse in each (requires '
+                             'NumPy)')
+    parser.add_argument('--infile', metavar='i', type=argparse.FileType('r'),
                         default=sys.stdin,
                         help='path to input file, default read from STDIN')
+    parser.add_argument('--jobs', metavar='n', type=int,
+                        help='parse lines in n processes and print one '
+                             'JSON record per line, in input order')
+    parser.add_argument('--chunk-size', metavar='n', type=int, default=64,
+                        help='number of lines sent to a process at once '
+                             'with --jobs')
+    parser.add_argument('--casefold', action='store_true',
+                        help='match words to the lexicon case-insensitively')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use the on-disk cache of compiled '
+                             'PCCG and OPDL files')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='clear the on-disk cache before loading')
+    parser.add_argument('--parser', choices=sorted(PARSERS),
+                        help='print only the best parse, found with the '
+                             'given parser')
+    parser.add_argument('--beam', metavar='k', type=int,
+                        help='keep at most k items of each category in '
+                             'each chart cell')
+    parser.add_argument('--threshold', metavar='t', type=float,
+                        help='drop chart items less than t times as '
+                             'probable as the best item in their cell')
+    parser.add_argument('--profile', metavar='json', nargs='?', const='-',
+                        help='record timings and counters and print a '
+                             'summary to STDERR at exit, or write them to '
+                             'the file json')
     parser.add_argument('-v', action='store_true',
                         help='print more parsing infomation')
     args = parser.parse_args()
-    ds = [d for d in parse(lex(args.pccg.read()))]
-    kb = KnowledgeBase(args.opdl)
-
+    if args.beam is not None and args.beam < 1:
+        parser.error('--beam must be at least 1')
+    if args.threshold is not None and not 0.0 <= args.threshold <= 1.0:
+        parser.error('--threshold must be between 0 and 1')
+    if args.contexts and (args.context or args.parser
+                          or args.beam is not None
+                          or args.threshold is not None):
+        # fill_chart_contexts neither prunes nor ranks parses
+        parser.error('--contexts cannot be combined with --context, '
+                     '--parser, --beam or --threshold')
+    if args.contexts:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            parser.error('--contexts requires NumPy: pip install .[numpy]')
+    if args.parser == 'agenda' and (args.beam is not None
+                                    or args.threshold is not None):
+        parser.error('--beam and --threshold cannot be combined with '
+                     '--parser agenda')
+    if args.jobs is not None and (args.contexts or args.parser):
+        parser.error('--jobs cannot be combined with --contexts or '
+                     '--parser')
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.jobs and args.jobs > 1 and args.profile:
+        # Worker processes keep their own counters, which are never merged
+        parser.error('--profile cannot be combined with more than one job')
+    if args.profile:
+        instrument.enable()
+        atexit.register(instrument.dump, args.profile)
+    pccg_cache, opdl_cache = DiskCache('pccg'), DiskCache('opdl')
+    if args.clear_cache:
+        pccg_cache.clear()
+        opdl_cache.clear()
+    ds = load_lexicon(args.pccg, casefold=args.casefold,
+                      disk_cache=None if args.no_cache else pccg_cache)
+    kb = KnowledgeBase(args.opdl,
+                       disk_cache=None if args.no_cache else opdl_cache)
+
+    # Only the CKY parser prunes
+    pruning = {}
+    if args.beam is not None or args.threshold is not None:
+        pruning = {'beam': args.beam, 'threshold': args.threshold}
+    if args.jobs is not None:
+        for record in batch_parse(args.infile, ds, kb, args.context,
+                                  args.beam, args.threshold, args.jobs,
+                                  args.chunk_size):
+            print(record)
+        return
     for line in args.infile:
-        print(chartparse(line.split(), ds, kb, args.context, args.v))
+        if args.contexts:
+            parses = chartparse_contexts(line.split(), ds, kb, args.contexts)
+            print(best_parses(parses) if parses else False)
+            continue
+        if args.parser:
+            # Print the probability of the best parse, as chartparse would,
+            # rather than its log probability
+            print([(typ, production, math.exp(logprob))
+                   for typ, production, logprob in PARSERS[args.parser](
+                       line.split(), ds, kb, args.context, k=1, **pruning)]
+                  or False)
+            continue
+        print(chartparse(line.split(), ds, kb, args.context, args.v,
+                         beam=args.beam, threshold=args.threshold))
+    if args.v:
+        print(kb.query_cache)
 
 
 if __name__ == "__main__":
-    main()
+    # Run the imported module's main, so that pickled definitions refer to
+    # robiphora.ccg rather than __main__
+    import robiphora.ccg
+    robiphora.ccg.main()
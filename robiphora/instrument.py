@@ -0,0 +1,148 @@
+"""
+Instrumentation
+===============
+
+Lightweight timers and counters for the hot paths of Robiphora.  They are
+disabled by default, in which case instrumented code only pays for a check
+of ``instrument.enabled``::
+
+    from robiphora import instrument
+
+    instrument.enable()
+    ...
+    print(instrument.summary())
+"""
+import json
+import sys
+import time
+from collections import defaultdict
+
+enabled = False
+
+# Total seconds and number of calls per timed stage
+timings = defaultdict(float)
+calls = defaultdict(int)
+# Event counts and high-water marks
+counters = defaultdict(int)
+maxima = defaultdict(int)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    for d in (timings, calls, counters, maxima):
+        d.clear()
+
+
+def count(name, n=1):
+    counters[name] += n
+
+
+def maximum(name, value):
+    if value > maxima[name]:
+        maxima[name] = value
+
+
+class _Timer:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        timings[self.name] += time.perf_counter() - self.start
+        calls[self.name] += 1
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timed(name):
+    """
+    Return a context manager which adds the time spent in it to the stage
+    ``name``.
+    """
+    if not enabled:
+        return _null_timer
+    return _Timer(name)
+
+
+def timed_iter(name, iterable):
+    """
+    Wrap ``iterable`` so the time spent producing each item is added to the
+    stage ``name``, for timing lazy stages such as lexing and parsing.
+    """
+    if not enabled:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+
+def _timed_iter(name, iterator):
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[name] += time.perf_counter() - start
+        calls[name] += 1
+        yield item
+
+
+def report():
+    """
+    Return everything recorded so far as a JSON-serializable dict.
+    """
+    return {
+        'timings': {k: {'seconds': timings[k], 'calls': calls[k]}
+                    for k in sorted(timings)},
+        'counters': dict(sorted(counters.items())),
+        'maxima': dict(sorted(maxima.items())),
+    }
+
+
+def summary():
+    """
+    Return everything recorded so far as a human readable table.
+    """
+    lines = ['{:<32}{:>12}{:>12}'.format('stage', 'seconds', 'calls')]
+    for k in sorted(timings):
+        lines.append('{:<32}{:>12.6f}{:>12}'.format(k, timings[k], calls[k]))
+    lines.append('')
+    lines.append('{:<32}{:>12}'.format('counter', 'value'))
+    for k, v in sorted(counters.items()):
+        lines.append('{:<32}{:>12}'.format(k, v))
+    for k, v in sorted(maxima.items()):
+        lines.append('{:<32}{:>12}'.format(k + ' (max)', v))
+    return '\n'.join(lines)
+
+
+def dump(path='-'):
+    """
+    Print the :func:`summary` to standard error if ``path`` is ``-``,
+    otherwise write the :func:`report` to ``path`` as JSON.
+    """
+    if path == '-':
+        print(summary(), file=sys.stderr)
+    else:
+        with open(path, 'w') as f:
+            json.dump(report(), f, indent=2)
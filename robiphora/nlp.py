@@ -0,0 +1,97 @@
+"""
+Natural Language Processing
+===========================
+
+Glue between spaCy and the knowledge base for resolving noun phrases.
+"""
+import functools
+import math
+
+# Pipeline components which noun phrase resolution has no use for: we only
+# need part of speech tags and noun chunks.
+UNUSED_PIPES = ['ner', 'lemmatizer', 'textcat', 'entity_ruler',
+                'entity_linker']
+
+
+def load_spacy(model):
+    """
+    Load the spaCy ``model`` without the components in ``UNUSED_PIPES``.
+    spaCy itself is imported here as importing it is slow too.
+    """
+    import spacy
+    if int(spacy.__version__.split('.')[0]) >= 3:
+        # Excluded components are not even loaded
+        return spacy.load(model, exclude=UNUSED_PIPES)
+    return spacy.load(model, disable=UNUSED_PIPES)
+
+
+def parse_words(line):
+    """
+    Split ``line`` into words for :func:`robiphora.ccg.chartparse`.
+    """
+    return line.replace(',', '').replace('.', '').split()
+
+
+@functools.lru_cache(maxsize=None)
+def baseref_key(pos):
+    """
+    Return the :attr:`KnowledgeBase.baserefs` key for words with the spaCy
+    part of speech tag ``pos``, such as ``nouns`` for ``NOUN``.
+    """
+    import spacy
+    return spacy.explain(pos) + 's'
+
+
+def resolve(doc, kb, compiled=False, k=None):
+    """
+    Resolve each noun chunk of the spaCy ``doc`` against ``kb``.  Yields
+    ``(noun_phrase, scores)``, where ``scores`` is a list of ``(object,
+    probability)`` pairs, or ``None`` if no base types are known for the
+    phrase.  If ``k`` is ``None``, every object in ``kb`` is scored, in
+    order; otherwise only the ``k`` most probable objects are given, most
+    probable first (see :meth:`KnowledgeBase.resolve`).  If ``compiled`` is
+    true, objects are scored with :meth:`KnowledgeBase.compile`.
+    """
+    for np in doc.noun_chunks:
+        baseset = set()
+        for tok in np:
+            refs = kb.baserefs.get(baseref_key(tok.pos_), {})
+            baseset |= refs.get(tok.text.casefold(), set())
+        if not baseset:
+            yield np, None
+            continue
+        if compiled:
+            matrix = kb.compile()
+            scores = list(zip(matrix.objects,
+                              map(float, matrix.score_objects(baseset))))
+            if k is not None:
+                scores = sorted(scores, key=lambda s: -s[1])[:k]
+        elif k is None:
+            scores = [(obj, kb.score(obj, baseset))
+                      for obj in kb.objects.values()]
+        else:
+            scores = kb.resolve(baseset, k)
+        yield np, scores
+
+
+def resolution_record(doc, kb, compiled=False, k=None):
+    """
+    Return the results of :func:`resolve` as a list of JSON-serializable
+    dicts.
+    """
+    return [{'text': np.text,
+             'objects': None if scores is None else {
+                 obj.name: p for obj, p in scores}}
+            for np, scores in resolve(doc, kb, compiled, k)]
+
+
+def parse_record(parses):
+    """
+    Return the ``(category, production, log probability)`` tuples from
+    :func:`robiphora.ccg.kbest` as a list of JSON-serializable dicts.  JSON
+    has no infinity, so the log probability of an impossible parse is
+    ``None``.
+    """
+    return [{'semantics': repr(production),
+             'logprob': logprob if logprob > -math.inf else None}
+            for _, production, logprob in parses]
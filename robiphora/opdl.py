@@ -8,14 +8,20 @@ This module contains utilities for using OPDL in Python.
 """
 import re
 import os
-from collections import defaultdict
+import operator
+from functools import reduce
+from collections import defaultdict, OrderedDict
+from concurrent import futures
+from robiphora import instrument
 
 
 class CompleteExpression:
-    pass
+    __slots__ = ()
 
 
 class SExpression(CompleteExpression):
+    __slots__ = ('args', 'kwargs')
+
     def __init__(self, args, kwargs):
         self.args = list(args)
         self.kwargs = dict(kwargs)
@@ -28,6 +34,8 @@ class SExpression(CompleteExpression):
 
 
 class PartialSE:
+    __slots__ = ('args', 'kwargs')
+
     def __init__(self, args=None, kwargs=None):
         if args is None:
             args = []
@@ -41,11 +49,15 @@ class PartialSE:
 
 
 class Symbol(CompleteExpression, str):
+    __slots__ = ()
+
     def __repr__(self):
         return str(self)
 
 
 class String(CompleteExpression, str):
+    __slots__ = ()
+
     def __repr__(self):
         r = super().__repr__()
         if r.startswith("'"):
@@ -55,11 +67,15 @@ class String(CompleteExpression, str):
 
 
 class LParen:
+    __slots__ = ()
+
     def __repr__(self):
         return '('
 
 
 class KeywordArgName:
+    __slots__ = ('name', )
+
     def __init__(self, name):
         self.name = name
 
@@ -68,6 +84,8 @@ class KeywordArgName:
 
 
 class KeywordArg:
+    __slots__ = ('name', 'value')
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
@@ -90,25 +108,46 @@ control_classes = {
 }
 
 
-def lex(code):
+def lex(code, chunk_size=65536):
     """
-    Lexically analyze the input.
+    Lexically analyze the input, a string or a file.  Files are read
+    ``chunk_size`` characters at a time, so tokens are produced without
+    holding the whole file in memory.
     """
-    last_end = 0
-    for m in tokenizer_p.finditer(code):
-        if m.start() != last_end:
-            raise SyntaxError("malformed input: {!r}".format(
-                code[last_end:m.start()]))
-        last_end = m.end()
-        if m.group('control'):
-            yield control_classes[m.group('control')]()
-        elif m.group('kwarg'):
-            yield KeywordArgName(m.group('kwarg')[1:])
-        elif m.group('symbol'):
-            yield Symbol(m.group('symbol'))
-        elif m.group('string'):
-            yield String(m.group('string')[1:-1])
-    if last_end != len(code):
+    if hasattr(code, "read"):
+        chunks = iter(lambda: code.read(chunk_size), '')
+    else:
+        chunks = iter((code, ))
+    buf = ''
+    eof = False
+    while not eof:
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+        else:
+            buf += chunk
+        last_end = 0
+        for m in tokenizer_p.finditer(buf):
+            if m.start() != last_end:
+                if not eof and '"' in buf[last_end:m.start()]:
+                    # a string may continue in the next chunk
+                    break
+                raise SyntaxError("malformed input: {!r}".format(
+                    buf[last_end:m.start()]))
+            if m.end() == len(buf) and not eof:
+                # the token may continue in the next chunk
+                break
+            last_end = m.end()
+            if m.group('control'):
+                yield control_classes[m.group('control')]()
+            elif m.group('kwarg'):
+                yield KeywordArgName(m.group('kwarg')[1:])
+            elif m.group('symbol'):
+                yield Symbol(m.group('symbol'))
+            elif m.group('string'):
+                yield String(m.group('string')[1:-1])
+        buf = buf[last_end:]
+    if buf:
         raise SyntaxError("malformed tokens at end of input")
 
 
@@ -122,42 +161,65 @@ def match(stack, types):
 
 
 def separse(tokens):
-    tokens = iter(tokens)
-    stack = []
-    while True:
-        if match(stack, [KeywordArgName, CompleteExpression]):
-            e, k = (stack.pop() for _ in range(2))
-            stack.append(KeywordArg(k.name, e))
-        elif match(stack, [KeywordArg, PartialSE]):
-            e, k = (stack.pop() for _ in range(2))
-            if e.args:
-                raise SyntaxError('keywords must come at end of expression')
-            if k.name in e.kwargs.keys():
-                raise SyntaxError('{} defined twice'.format(k.name))
-            e.kwargs[k.name] = k.value
-            stack.append(e)
-        elif match(stack, [CompleteExpression, PartialSE]):
-            e, s = (stack.pop() for _ in range(2))
-            e.args.append(s)
-            stack.append(e)
-        elif match(stack, [LParen, PartialSE]):
-            e, p = (stack.pop() for _ in range(2))
-            stack.append(SExpression(e.args[::-1], e.kwargs))
-        elif len(stack) == 1 and isinstance(stack[0], SExpression):
-            yield stack.pop()
+    """
+    Parse the tokens produced by :func:`lex` in a single pass, yielding each
+    top-level :class:`SExpression` as soon as its closing parenthesis is
+    read.
+
+    ``frames`` holds the items of each open expression, innermost last, and
+    starts with the items at the top level.  Malformed input leaves items at
+    the top level, or a :class:`PartialSE` marking a parenthesis which can
+    never be closed, after which nothing more is yielded and a
+    :class:`SyntaxError` is raised at the end of input.
+    """
+    frames = [[]]
+    for token in tokens:
+        if isinstance(token, LParen):
+            frames.append([])
+            continue
+        if isinstance(token, KeywordArgName):
+            frames[-1].append(token)
+            continue
+        if isinstance(token, PartialSE):
+            items = frames[-1]
+            args, kwargs = [], {}
+            while items and isinstance(items[-1],
+                                       (CompleteExpression, KeywordArg)):
+                item = items.pop()
+                if isinstance(item, KeywordArg):
+                    if args:
+                        raise SyntaxError(
+                            'keywords must come at end of expression')
+                    if item.name in kwargs.keys():
+                        raise SyntaxError(
+                            '{} defined twice'.format(item.name))
+                    kwargs[item.name] = item.value
+                else:
+                    args.append(item)
+            if items or len(frames) == 1:
+                items.append(PartialSE(args, kwargs))
+                continue
+            frames.pop()
+            token = SExpression(args[::-1], kwargs)
+        items = frames[-1]
+        if items and isinstance(items[-1], KeywordArgName):
+            items[-1] = KeywordArg(items[-1].name, token)
+        elif (len(frames) == 1 and not items
+              and isinstance(token, SExpression)):
+            yield token
         else:
-            try:
-                stack.append(next(tokens))
-            except StopIteration:
-                break
-    if stack:
+            items.append(token)
+    if len(frames) > 1 or frames[0]:
         raise SyntaxError('parse error')
 
 
 class OPDLData:
     """
-    Base class for constructs in OPDL.
+    Base class for constructs in OPDL.  Subclasses list their attributes
+    in ``namepairs`` and as ``__slots__``.
     """
+    __slots__ = ('name', )
+
     def __init__(self, name, **kwargs):
         self.name = name
         for attrname, _ in self.__class__.namepairs:
@@ -194,48 +256,564 @@ class Type(OPDLData):
                  ("adjectives", "provides-adjectives"),
                  ("pronouns", "pronouns"),
                  ("nouns", "nouns"))
+    __slots__ = tuple(attrname for attrname, _ in namepairs)
 
 
 class Object(OPDLData):
     namepairs = (("types", "type"), )
+    __slots__ = ('types', )
+
+
+def definitions(code):
+    """
+    Return an iterator of ``(kind, name, data)`` tuples for each top-level
+    form of the OPDL ``code``, a string or file: ``data`` is the
+    :class:`Object` or :class:`Type` defined, or ``None`` for an ``import``
+    of the file ``name``.
+    """
+    return instrument.timed_iter('opdl.parse', _definitions(code))
+
+
+def _definitions(code):
+    for se in separse(lex(code)):
+        if se.args[0] == 'import':
+            yield 'import', se.args[1], None
+        elif se.args[0] == 'object':
+            yield 'object', se.args[1], Object.from_se(se)
+        elif se.args[0] == 'type':
+            yield 'type', se.args[1], Type.from_se(se)
+        else:
+            raise SyntaxError("Unknown OPDL data: {!r}".format(se.args[0]))
+
+
+def compile_file(filename, disk_cache=None):
+    """
+    Return the list of :func:`definitions` in the OPDL file ``filename``,
+    compiled through ``disk_cache`` if it is given.
+    """
+    with open(filename) as f:
+        if disk_cache is not None:
+            return disk_cache.get(filename, lambda: list(definitions(f)))
+        return list(definitions(f))
+
+
+# Marks a key missing from a QueryCache
+_MISSING = object()
+
+
+class QueryCache:
+    """
+    A bounded cache of :meth:`KnowledgeBase.query_is` results which evicts
+    the least recently used entry when full.  ``hits`` and ``misses`` count
+    lookups since the cache was created.
+    """
+    def __init__(self, maxsize=65536):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '{}(hits={}, misses={}, size={}, maxsize={})'.format(
+            self.__class__.__name__,
+            self.hits,
+            self.misses,
+            len(self),
+            self.maxsize)
+
+    def lookup(self, key, compute):
+        """
+        Return the cached value for ``key``, calling ``compute()`` to fill it
+        in on a miss.
+        """
+        # compute() runs outside of any exception handler, so that its
+        # errors are not reported as raised while handling a miss
+        value = self._entries.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            value = self._entries[key] = compute()
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return value
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+
+class TypeMatrix:
+    """
+    A dense NumPy matrix ``p`` where ``p[i, j]`` is the probability that an
+    object of type ``names[i]`` is of type ``names[j]`` as well, along with
+    the types of every object in the knowledge base for vectorized scoring.
+
+    The matrix is computed as a max-product fixed point: 1.0 on the
+    diagonal, 0.0 for antibases, and otherwise the best of 0.9 times any
+    base's row and 0.1 times any other type's row.  This is the best-path
+    probability explored by :meth:`KnowledgeBase.query_is`; the two only
+    differ where ``query_is`` visits a type through the fallback search
+    before reaching it through a base, which cuts its search short.
+
+    Use :meth:`KnowledgeBase.compile` to build one.
+    """
+    def __init__(self, kb):
+        import numpy as np
+        self.names = list(kb.types.keys())
+        self.index = {name: i for i, name in enumerate(self.names)}
+        n = len(self.names)
+        cols = np.arange(n)
+        eye = np.eye(n, dtype=bool)
+        antibases = np.zeros((n, n), dtype=bool)
+        bases = []
+        for i, t in enumerate(kb.types.values()):
+            bases.append([self.index[b] for b in t.bases if b in self.index])
+            for b in t.antibases:
+                if b in self.index:
+                    antibases[i, self.index[b]] = True
+
+        p = eye.astype(float)
+        # Without types there is nothing to compute, and no maximum to take
+        for _ in range(n + 1 if n else 0):
+            # Best P(c is b) over all c != a: the column maximum, or the
+            # runner up in the row which holds the maximum.
+            best = p.argmax(axis=0)
+            runner_up = p.copy()
+            runner_up[best, cols] = -1.0
+            fallback = np.tile(p.max(axis=0), (n, 1))
+            fallback[best, cols] = runner_up.max(axis=0)
+            new = 0.1 * fallback
+            for i, bs in enumerate(bases):
+                if bs:
+                    np.maximum(new[i], 0.9 * p[bs].max(axis=0), out=new[i])
+            new[antibases] = 0.0
+            new[eye] = 1.0
+            if np.array_equal(new, p):
+                break
+            p = new
+        self.p = p
+        self._padded = np.vstack((p, np.zeros((1, n))))
+        self.index_objects(kb.objects.values())
+
+    def index_objects(self, objects):
+        """
+        Record the types of each of ``objects`` for :meth:`score_objects`.
+        """
+        import numpy as np
+        n = len(self.names)
+        self.objects = list(objects)
+        # Object types as row indices, padded with the row of zeros at ``n``
+        width = max((len(o.types) for o in self.objects), default=0)
+        self.object_types = np.full((len(self.objects), width), n)
+        for i, obj in enumerate(self.objects):
+            for j, t in enumerate(obj.types):
+                self.object_types[i, j] = self.index[t]
+
+    def query_is(self, a, b):
+        """
+        Look up the probability that an object of type ``a`` is of type
+        ``b`` as well.
+        """
+        if a == b:
+            return 1.0
+        return float(self.p[self.index[a], self.index[b]])
+
+    def score_objects(self, baseset):
+        """
+        Return an array with the probability of each object in
+        ``self.objects`` being of every type in ``baseset``.
+        """
+        cols = [self.index[b] for b in baseset]
+        per_type = self._padded[:, cols][self.object_types]
+        # An object without types is of no type
+        return per_type.max(axis=1, initial=0.0).prod(axis=1)
+
+
+class ObjectIndex:
+    """
+    An index from each type to the objects which have it, or one of its
+    subtypes, among their types.  ``by_type`` maps type names to sets of
+    object names, and ``order`` numbers the objects in the order they were
+    defined.  The index is kept up to date as objects change, and only
+    dropped when the bases of a type objects are indexed under change.
+
+    Use :meth:`KnowledgeBase.resolve` to query one.
+    """
+    def __init__(self, kb):
+        self.kb = kb
+        self.by_type = defaultdict(set)
+        self.order = {}
+        self._next = 0
+        self._ancestors_of = {}
+        for obj in kb.objects.values():
+            self.update(obj.name, (), obj.types)
+
+    def ancestors(self, types):
+        """
+        Return the set of ``types`` and every type reachable from them
+        through bases.
+        """
+        result = set()
+        for t in types:
+            if t not in self._ancestors_of:
+                self._ancestors_of[t] = self._ancestors(self.kb, t)
+            result |= self._ancestors_of[t]
+        return result
+
+    def update(self, name, old_types, new_types):
+        """
+        Move the object ``name`` from ``old_types`` to ``new_types``.
+        Objects not yet in the index are numbered after all the others.
+        """
+        if name not in self.order:
+            self.order[name] = self._next
+            self._next += 1
+        old = self.ancestors(old_types)
+        new = self.ancestors(new_types)
+        for t in old - new:
+            names = self.by_type[t]
+            names.discard(name)
+            if not names:
+                del self.by_type[t]
+        for t in new - old:
+            self.by_type[t].add(name)
+
+    def forget(self, name):
+        """
+        Forget the ancestors found through the type ``name``, whose bases
+        have changed.  No object may be indexed under ``name``.
+        """
+        self._ancestors_of = {t: a for t, a in self._ancestors_of.items()
+                              if name not in a}
+
+    def remove(self, name, types):
+        """
+        Remove the object ``name`` of the given ``types``.
+        """
+        self.update(name, types, ())
+        del self.order[name]
+
+    @staticmethod
+    def _ancestors(kb, name):
+        # The type itself and every type reachable through bases
+        seen = {name}
+        stack = [name]
+        while stack:
+            t = kb.types.get(stack.pop())
+            if t is None:
+                continue
+            for base in t.bases - seen:
+                seen.add(base)
+                stack.append(base)
+        return seen
+
+    def candidates(self, baseset):
+        """
+        Return the names of the objects with a type descended from any
+        type in ``baseset``.
+        """
+        return set().union(*(self.by_type.get(b, ()) for b in baseset))
+
+
+def _refs():
+    # A named function rather than a lambda so KnowledgeBases pickle
+    return defaultdict(set)
 
 
 class KnowledgeBase:
-    def __init__(self, init_load=None):
+    def __init__(self, init_load=None, cache_size=65536, disk_cache=None,
+                 executor=None):
         self.objects = {}
         self.types = {}
-        self.baserefs = defaultdict(lambda: defaultdict(set))
+        self.baserefs = defaultdict(_refs)
+        self.query_cache = QueryCache(cache_size) if cache_size else None
+        self.type_matrix = None
+        self.object_index = None
+        self.disk_cache = disk_cache
+        # Incremented whenever the types change, so that results derived
+        # from query_is elsewhere know when to be recomputed
+        self.generation = 0
+        # Real paths of the files loaded so far
+        self.loaded = set()
         if init_load:
-            self.load(init_load)
-
-    def load(self, code, path=None):
-        if path is None and hasattr(code, "name"):
-            path = os.path.dirname(code.name)
-        if hasattr(code, "read"):
-            code = code.read()
-        for se in separse(lex(code)):
-            if se.args[0] == 'import':
-                if path is not None:
-                    with open("{}/{}".format(path, se.args[1])) as f:
-                        self.load(f)
-                else:
-                    raise TypeError("import only supported on named files")
-            elif se.args[0] == 'object':
-                self.objects[se.args[1]] = Object.from_se(se)
-            elif se.args[0] == 'type':
-                t = Type.from_se(se)
-                for aname, aset in t.baserefs():
-                    for ref in aset:
-                        self.baserefs[aname][ref].add(se.args[1])
-                self.types[se.args[1]] = t
+            self.load(init_load, executor=executor)
+
+    def _types_changed(self, name, old_bases=frozenset(),
+                       new_bases=frozenset()):
+        """
+        Called whenever the type ``name`` is added, redefined or removed,
+        with its bases before and after.  Any type may take part in the
+        fallback search of :meth:`query_is`, so cached results cannot be
+        trusted after a change.  The object index only depends on bases, so
+        it is kept unless they change, and only rebuilt if objects are
+        indexed under ``name``.
+        """
+        if self.query_cache is not None:
+            self.query_cache.clear()
+        self.type_matrix = None
+        self.generation += 1
+        if self.object_index is not None and old_bases != new_bases:
+            if name in self.object_index.by_type:
+                self.object_index = None
+            else:
+                self.object_index.forget(name)
+
+    def _objects_changed(self, name, old_types=(), new_types=None):
+        """
+        Called whenever the object ``name`` is added, changed or (if
+        ``new_types`` is ``None``) removed.  Only the object indexes are
+        affected, and :class:`ObjectIndex` is updated in place.
+        """
+        if self.type_matrix is not None:
+            self.type_matrix.objects = None
+        if self.object_index is not None:
+            if new_types is None:
+                self.object_index.remove(name, old_types)
+            else:
+                self.object_index.update(name, old_types, new_types)
+
+    def compile(self):
+        """
+        Compile the type hierarchy into a :class:`TypeMatrix`, stored as
+        ``self.type_matrix`` until the knowledge base changes.  Requires
+        NumPy.
+        """
+        if self.type_matrix is None:
+            self.type_matrix = TypeMatrix(self)
+        elif self.type_matrix.objects is None:
+            self.type_matrix.index_objects(self.objects.values())
+        return self.type_matrix
+
+    def _put_type(self, t):
+        old = self.types.get(t.name)
+        if old is not None:
+            self._unref_type(old)
+        for aname, aset in t.baserefs():
+            for ref in aset:
+                self.baserefs[aname][ref].add(t.name)
+        self.types[t.name] = t
+        self._types_changed(t.name, old.bases if old else frozenset(),
+                            t.bases)
+
+    def _unref_type(self, t):
+        for aname, aset in t.baserefs():
+            for ref in aset:
+                names = self.baserefs[aname][ref]
+                names.discard(t.name)
+                if not names:
+                    del self.baserefs[aname][ref]
+
+    def add_type(self, name, **attrs):
+        """
+        Define (or redefine) the type ``name``.  Keyword arguments are the
+        attributes of :class:`Type`, such as ``bases`` or ``nouns``, given
+        as iterables of names.
+        """
+        t = Type(name)
+        for attrname, value in attrs.items():
+            if attrname not in dict(Type.namepairs):
+                raise TypeError(
+                    "{!r} is not an attribute of Type".format(attrname))
+            setattr(t, attrname, set(value))
+        self._put_type(t)
+        return t
+
+    def remove_type(self, name):
+        """
+        Remove the type ``name``.  Raises :class:`ValueError` if any other
+        type has it as a base or antibase, or any object has it as a type,
+        as queries involving those would fail.
+        """
+        referrers = sorted(
+            (set(self.baserefs.get('bases', {}).get(name, ()))
+             | set(self.baserefs.get('antibases', {}).get(name, ())))
+            - {name})
+        referrers += sorted(
+            o.name for o in self.objects.values() if name in o.types)
+        if referrers:
+            raise ValueError("type {!r} is referred to by {}".format(
+                name, ", ".join(referrers)))
+        t = self.types.pop(name)
+        self._unref_type(t)
+        self._types_changed(name, t.bases)
+
+    def add_object(self, name, types):
+        """
+        Define (or redefine) the object ``name`` of the given ``types``.
+        """
+        obj = Object(name)
+        obj.types = set(types)
+        self._put_object(obj)
+        return obj
+
+    def update_object(self, name, types):
+        """
+        Change the types of the existing object ``name``.
+        """
+        obj = self.objects[name]
+        old_types, obj.types = obj.types, set(types)
+        self._objects_changed(name, old_types, obj.types)
+
+    def remove_object(self, name):
+        self._objects_changed(name, self.objects.pop(name).types)
+
+    def _put_object(self, obj):
+        old = self.objects.get(obj.name)
+        self.objects[obj.name] = obj
+        self._objects_changed(obj.name, old.types if old else (), obj.types)
+
+    def load(self, code, path=None, executor=None):
+        """
+        Load OPDL ``code``, a string or file.  Imports are resolved relative
+        to ``path``, which defaults to the directory of the file, and each
+        imported file is loaded at most once, which also breaks import
+        cycles.  Regular files are compiled through ``self.disk_cache`` if it
+        is set.
+
+        If a :class:`concurrent.futures.Executor` is given, all imported
+        files are compiled on it concurrently before any are loaded.  The
+        result is the same as loading them in order.
+        """
+        with instrument.timed('opdl.load'):
+            if path is None and hasattr(code, "name"):
+                path = os.path.dirname(code.name)
+            if hasattr(code, "name"):
+                self.loaded.add(os.path.realpath(code.name))
+            if (self.disk_cache is not None and hasattr(code, "name")
+                    and os.path.isfile(code.name)):
+                defs = self.disk_cache.get(
+                    code.name, lambda: list(definitions(code)))
             else:
-                raise SyntaxError("Unknown OPDL data: {!r}".format(se.args[0]))
+                defs = definitions(code)
+            compiled = {}
+            if executor is not None:
+                defs = list(defs)
+                compiled = self._compile_imports(defs, path, executor)
+            self._apply(defs, path, compiled)
+
+    def _compile_imports(self, defs, path, executor):
+        """
+        Compile every file imported (transitively) by ``defs`` which is not
+        yet loaded on ``executor``.  Returns a dict from the real path of
+        each file to its definitions.
+        """
+        compiled = {}
+        pending = {}
+
+        def submit(defs, path):
+            for kind, name, _ in defs:
+                if kind != 'import' or path is None:
+                    continue
+                filename = os.path.join(path, name)
+                key = os.path.realpath(filename)
+                if (key in self.loaded or key in compiled
+                        or key in pending):
+                    continue
+                pending[key] = (
+                    executor.submit(compile_file, filename, self.disk_cache),
+                    os.path.dirname(filename))
+
+        submit(defs, path)
+        while pending:
+            done, _ = futures.wait([f for f, _ in pending.values()],
+                                   return_when=futures.FIRST_COMPLETED)
+            for key in [k for k, (f, _) in pending.items() if f in done]:
+                future, dirname = pending.pop(key)
+                compiled[key] = future.result()
+                submit(compiled[key], dirname)
+        return compiled
+
+    def _apply(self, defs, path, compiled):
+        for kind, name, data in defs:
+            if kind == 'import':
+                if path is None:
+                    raise TypeError("import only supported on named files")
+                filename = os.path.join(path, name)
+                key = os.path.realpath(filename)
+                if key in self.loaded:
+                    continue
+                self.loaded.add(key)
+                if key in compiled:
+                    imported = compiled[key]
+                else:
+                    imported = compile_file(filename, self.disk_cache)
+                self._apply(imported, os.path.dirname(filename), compiled)
+            elif kind == 'object':
+                self._put_object(data)
+            elif kind == 'type':
+                self._put_type(data)
+
+    def score(self, obj, baseset):
+        """
+        Return the probability that the object ``obj`` is of every type in
+        ``baseset``: the product over ``baseset`` of the best
+        :meth:`query_is` of any of the object's types.
+        """
+        antibase_of = self.baserefs.get('antibases', {})
+        factors = []
+        for b in baseset:
+            if b not in obj.types and obj.types <= antibase_of.get(b, set()):
+                # Every type of the object rules b out
+                return 0.0
+            factors.append(max(self.query_is(t, b) for t in obj.types))
+        return reduce(operator.mul, factors, 1.0)
+
+    def resolve(self, baseset, k=None):
+        """
+        Return the ``k`` (or all, if ``k`` is ``None``) most probable
+        objects to be of every type in ``baseset``, as ``(object,
+        probability)`` pairs ranked by probability, with ties in the order
+        the objects were defined.
+
+        Objects with no type descended from a type in ``baseset`` can only
+        be reached through the 0.1 fallback of :meth:`query_is`, so they
+        are only scored when fewer than ``k`` other objects beat that bound.
+        Raises :class:`ValueError` if ``k`` is less than 1.
+        """
+        if k is not None and k < 1:
+            raise ValueError("k must be at least 1")
+        if self.object_index is None:
+            self.object_index = ObjectIndex(self)
+        order = self.object_index.order
+        if k is None:
+            names = self.objects
+        else:
+            names = self.object_index.candidates(baseset)
+        scored = sorted(
+            ((-self.score(self.objects[n], baseset), order[n], n)
+             for n in names))
+        if instrument.enabled:
+            instrument.count('resolve.scored', len(scored))
+        bound = reduce(operator.mul, (0.1 for _ in baseset), 1.0)
+        if k and (len(scored) < k or -scored[k - 1][0] <= bound):
+            # Objects outside the index may tie or beat the candidates
+            return self.resolve(baseset)[:k]
+        return [(self.objects[n], -p) for p, _, n in scored[:k]]
 
     def query_is(self, a, b, alpha=0.0, visited=None):
         """
         Query the probability that an object of type ``a`` is of type ``b``
         as well.
+
+        Top-level queries are memoized in ``self.query_cache``.
         """
+        if instrument.enabled:
+            instrument.count('query_is.calls')
+        if visited is not None or self.query_cache is None:
+            return self._query_is(a, b, alpha, visited)
+        return self.query_cache.lookup(
+            (a, b, alpha), lambda: self._query_is(a, b, alpha))
+
+    def _query_is(self, a, b, alpha=0.0, visited=None, depth=0):
+        if instrument.enabled:
+            instrument.count('query_is.searches')
+            instrument.maximum('query_is.depth', depth)
         if a == b or alpha == 1.0:
             return 1.0
         if b in self.types[a].antibases:
@@ -245,7 +823,7 @@ class KnowledgeBase:
         else:
             visited.add(a)
         for base in self.types[a].bases - visited:
-            p = 0.9 * self.query_is(base, b, alpha, visited)
+            p = 0.9 * self._query_is(base, b, alpha, visited, depth + 1)
             if p > alpha:
                 alpha = p
         if alpha < 0.1:
@@ -253,7 +831,7 @@ class KnowledgeBase:
             # types we don't have an explicit edge to...
             others = set(self.types.keys()) - self.types[a].bases - visited
             for base in others:
-                p = 0.1 * self.query_is(base, b, alpha, visited)
+                p = 0.1 * self._query_is(base, b, alpha, visited, depth + 1)
                 if p > alpha:
                     alpha = p
         return alpha
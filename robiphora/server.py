@@ -0,0 +1,156 @@
+"""
+Resolution Server
+=================
+
+An asyncio server which keeps a knowledge base, PCCG lexicon and spaCy
+pipeline loaded between requests.  Clients send one JSON request per line
+and receive one JSON response per line, tagged with the ``id`` of the
+request, as requests are served concurrently and may finish out of order::
+
+    {"id": 1, "op": "parse", "text": "I saw the wood", "context": "outside"}
+    {"id": 1, "result": [{"semantics": "see(I(), wood())", "logprob": ...}]}
+
+    {"id": 2, "op": "resolve", "text": "the red ball"}
+    {"id": 2, "result": [{"text": "the red ball", "objects": {...}}]}
+
+Requests may also give ``k``, the number of parses or most probable objects
+to return.
+Failed requests are answered with ``{"id": ..., "error": "message"}``.
+"""
+import asyncio
+import json
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import robiphora.ccg as ccg
+from robiphora import instrument
+from robiphora.nlp import parse_words, resolution_record, parse_record
+
+# The lexicon and knowledge base of a parse worker process
+_worker_state = None
+
+
+def _init_worker(lexicon, kb):
+    global _worker_state
+    _worker_state = (lexicon, kb)
+
+
+def _parse(text, context, k):
+    lexicon, kb = _worker_state
+    return parse_record(
+        ccg.kbest(parse_words(text), lexicon, kb, context, k=k))
+
+
+class Server:
+    """
+    Serve requests against ``kb``, ``lexicon`` and the spaCy pipeline
+    ``nlp``, which may be a :class:`concurrent.futures.Future` of a pipeline
+    which is still loading.
+
+    Parsing is CPU bound, so it runs on a pool of ``workers`` processes,
+    each of which is sent the lexicon and knowledge base once at startup.
+    The workers are spawned rather than forked, as the pipeline may still
+    be loading on another thread.
+    """
+    def __init__(self, kb, lexicon=None, nlp=None, workers=None,
+                 compiled=False):
+        self.kb = kb
+        self.nlp = nlp
+        self.compiled = compiled
+        self.parse_pool = None
+        if lexicon is not None:
+            self.parse_pool = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker, initargs=(lexicon, kb))
+        # spaCy pipelines and the query cache are not safe to share
+        # between threads, so resolution happens on a single thread
+        self.resolve_pool = ThreadPoolExecutor(1)
+        self.ops = {'parse': self.parse, 'resolve': self.resolve}
+
+    async def parse(self, request):
+        if self.parse_pool is None:
+            raise ValueError("no PCCG lexicon loaded")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.parse_pool, _parse, request['text'],
+            request.get('context'), request.get('k'))
+
+    async def resolve(self, request):
+        if self.nlp is None:
+            raise ValueError("no spaCy pipeline loaded")
+
+        def work():
+            nlp = self.nlp
+            if isinstance(nlp, Future):
+                nlp = nlp.result()
+            with instrument.timed('spacy'):
+                doc = nlp(request['text'])
+            return resolution_record(doc, self.kb, self.compiled,
+                                     request.get('k'))
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.resolve_pool, work)
+
+    async def respond(self, line, writer, lock):
+        request_id = None
+        try:
+            request = json.loads(line.decode('utf-8'))
+            request_id = request.get('id')
+            if request.get('op') not in self.ops:
+                raise ValueError("unknown op {!r}".format(request.get('op')))
+            result = await self.ops[request['op']](request)
+            response = {'id': request_id, 'result': result}
+        except Exception as e:
+            response = {'id': request_id,
+                        'error': '{}: {}'.format(e.__class__.__name__, e)}
+        writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8')
+                     + b'\n')
+        async with lock:
+            try:
+                await writer.drain()
+            except ConnectionResetError:
+                # The client has gone, and with it anyone to tell
+                pass
+
+    async def handle(self, reader, writer):
+        """
+        Serve one connection, answering each request as it completes.
+        """
+        lock = asyncio.Lock()
+        tasks = set()
+        while True:
+            try:
+                line = await reader.readline()
+            except ConnectionResetError:
+                break
+            if not line:
+                break
+            task = asyncio.ensure_future(self.respond(line, writer, lock))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionResetError:
+            pass
+
+    async def serve(self, host=None, port=None, path=None):
+        """
+        Serve forever on the Unix socket ``path`` if it is given, otherwise
+        on TCP ``host`` and ``port``.
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host=None, port=None, path=None):
+        try:
+            asyncio.run(self.serve(host, port, path))
+        finally:
+            if self.parse_pool is not None:
+                self.parse_pool.shutdown()
+            self.resolve_pool.shutdown()
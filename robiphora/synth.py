@@ -0,0 +1,110 @@
+"""
+Generators for synthetic OPDL knowledge bases, PCCG lexicons and sentences,
+for benchmarks and tests at sizes the examples do not reach.  Every
+generator takes a :class:`random.Random` so workloads are reproducible
+from a seed.
+"""
+
+
+# PCCG names may not contain digits, so names are spelled with letters
+def name(prefix, n):
+    letters = ''
+    while True:
+        n, r = divmod(n, 26)
+        letters += chr(ord('a') + r)
+        if not n:
+            return prefix + letters
+
+
+def type_hierarchy(rng, depth, branching, antibase_rate=0.1,
+                   extra_base_rate=0.1, objects=100):
+    """
+    Return ``(code, levels)``: OPDL source for a forest of types ``depth``
+    levels deep, where each type has ``branching`` subtypes, and the list
+    of type names at each level.  Subtypes sometimes have a second base
+    from the level above, types sometimes have an antibase elsewhere in
+    their level, and ``objects`` objects are given random leaf types.
+    """
+    levels = [[name('t', n) for n in range(branching)]]
+    count = branching
+    for _ in range(depth - 1):
+        level = []
+        for _ in range(len(levels[-1]) * branching):
+            level.append(name('t', count))
+            count += 1
+        levels.append(level)
+
+    lines = []
+    for d, level in enumerate(levels):
+        for i, t in enumerate(level):
+            bases = []
+            if d:
+                parents = levels[d - 1]
+                bases.append(parents[i // branching])
+                if rng.random() < extra_base_rate:
+                    extra = rng.choice(parents)
+                    if extra not in bases:
+                        bases.append(extra)
+            lines.append('(type {}'.format(t))
+            if bases:
+                lines.append('  :bases ({})'.format(' '.join(bases)))
+            if len(level) > 1 and rng.random() < antibase_rate:
+                other = rng.choice(level)
+                if other != t:
+                    lines.append('  :antibases ({})'.format(other))
+            lines.append('  :nouns ("{}"))'.format(t))
+    for n in range(objects):
+        lines.append('(object {}'.format(name('o', n)))
+        lines.append('  :type ({}))'.format(rng.choice(levels[-1])))
+    return '\n'.join(lines) + '\n', levels
+
+
+# Each part of speech has an unambiguous category and an alternative, so
+# that ambiguous words add both categories and attachments to the chart
+CATEGORIES = {
+    'det': ('NP/N', 'NP/NP'),
+    'noun': ('N', 'NP'),
+    'verb': ('(S\\NP)/NP', '((S\\NP)/NP)/NP'),
+    'prep': ('(NP\\NP)/NP', '((S\\NP)\\(S\\NP))/NP'),
+}
+SEMANTICS = {
+    'NP/N': 'λx.{}(x)',
+    'NP/NP': 'λx.{}(x)',
+    'N': '{}()',
+    'NP': '{}()',
+    '(S\\NP)/NP': 'λy.λx.{}(x,y)',
+    '((S\\NP)/NP)/NP': 'λz.λy.λx.{}(x,y,z)',
+    '(NP\\NP)/NP': 'λy.λx.{}(x,y)',
+    '((S\\NP)\\(S\\NP))/NP': 'λy.λf.λx.{}(f(x),y)',
+}
+
+
+def lexicon(rng, words, ambiguity, contexts):
+    """
+    Return ``(code, vocabulary)``: PCCG source defining ``words`` words of
+    each part of speech, each with ``ambiguity`` definitions weighted by
+    random ``contexts``, and a dict of the words of each part of speech.
+    """
+    lines = []
+    vocabulary = {}
+    for pos, categories in sorted(CATEGORIES.items()):
+        vocabulary[pos] = [name(pos, n) for n in range(words)]
+        for w in vocabulary[pos]:
+            for a in range(ambiguity):
+                category = categories[a % len(categories)]
+                predicate = name(w, a)
+                lines.append('{}:={}[{} 0.9, 0.5]:{}'.format(
+                    w, category, rng.choice(contexts),
+                    SEMANTICS[category].format(predicate)))
+    return '\n'.join(lines) + '\n', vocabulary
+
+
+def sentence(rng, vocabulary, length):
+    """
+    Return a list of about ``length`` words of the form ``det noun verb det
+    noun`` followed by prepositional phrases.
+    """
+    pattern = ['det', 'noun', 'verb', 'det', 'noun']
+    while len(pattern) + 3 <= length:
+        pattern += ['prep', 'det', 'noun']
+    return [rng.choice(vocabulary[pos]) for pos in pattern]
@@ -50,7 +50,7 @@ setup(
         'License :: OSI Approved :: MIT License',
 
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
 
     # What does your project relate to?
@@ -60,7 +60,7 @@ setup(
     # simple. Or you can use find_packages().
     packages=['robiphora'],
 
-    python_requires='>=3.6, <4',
+    python_requires='>=3.7, <4',
 
     # List run-time dependencies here.  These will be installed by pip when
     # your project is installed. For an analysis of "install_requires" vs pip's
@@ -68,6 +68,11 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=['spacy'],
 
+    # Optional dependencies, installable with e.g. ``pip install .[numpy]``
+    extras_require={
+        'numpy': ['numpy'],
+    },
+
     # To provide executable scripts, use entry points in preference to the
     # "scripts" keyword. Entry points provide cross-platform support and allow
     # pip to create the appropriate form of executable for the target platform.
@@ -0,0 +1,95 @@
+"""
+Tests for :mod:`robiphora.cache`.
+
+Run with::
+
+    $ python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+import robiphora.ccg as ccg
+from robiphora.cache import DiskCache
+from robiphora.opdl import KnowledgeBase
+
+
+def write(path, text, mtime_ns):
+    # Set the modification time explicitly, as writes within the clock's
+    # resolution could otherwise leave it unchanged
+    with open(path, 'w') as f:
+        f.write(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.cache = DiskCache('test', os.path.join(tmp.name, 'cache'))
+
+
+class TestDiskCache(CacheTestCase):
+    def test_reuses_fresh_entry(self):
+        source = os.path.join(self.directory, 'source')
+        write(source, 'a', 10**18)
+        builds = []
+
+        def build():
+            builds.append(None)
+            return len(builds)
+
+        self.assertEqual(self.cache.get(source, build), 1)
+        self.assertEqual(self.cache.get(source, build), 1)
+        self.assertEqual(len(builds), 1)
+
+    def test_rebuilds_stale_entry(self):
+        source = os.path.join(self.directory, 'source')
+        write(source, 'a', 10**18)
+        self.assertEqual(self.cache.get(source, lambda: 'a'), 'a')
+        write(source, 'b', 10**18 + 10**9)
+        self.assertEqual(self.cache.get(source, lambda: 'b'), 'b')
+        self.assertEqual(self.cache.get(source, lambda: 'c'), 'b')
+
+    def test_corrupt_entry_is_a_miss(self):
+        source = os.path.join(self.directory, 'source')
+        write(source, 'a', 10**18)
+        self.cache.get(source, lambda: 'a')
+        with open(self.cache.entry(source), 'wb') as f:
+            f.write(b'garbage')
+        self.assertEqual(self.cache.get(source, lambda: 'b'), 'b')
+
+    def test_clear(self):
+        source = os.path.join(self.directory, 'source')
+        write(source, 'a', 10**18)
+        self.cache.get(source, lambda: 'a')
+        self.cache.clear()
+        self.assertEqual(self.cache.get(source, lambda: 'b'), 'b')
+
+    def test_knowledge_base_sees_changes(self):
+        source = os.path.join(self.directory, 'world.opdl')
+        write(source, '(type tool)\n', 10**18)
+        with open(source) as f:
+            kb = KnowledgeBase(f, disk_cache=self.cache)
+        self.assertEqual(set(kb.types), {'tool'})
+        write(source, '(type tool)\n(type saw :bases (tool))\n',
+              10**18 + 10**9)
+        with open(source) as f:
+            kb = KnowledgeBase(f, disk_cache=self.cache)
+        self.assertEqual(set(kb.types), {'tool', 'saw'})
+        self.assertEqual(kb.types['saw'].bases, {'tool'})
+
+    def test_lexicon_sees_changes(self):
+        source = os.path.join(self.directory, 'saw.pccg')
+        for n, code in enumerate(('saw:=N:saw()\n',
+                                  'saw:=N:saw()\n'
+                                  'saw:=(S\\NP)/NP:λy.λx.saw(x,y)\n')):
+            write(source, code, 10**18 + n * 10**9)
+            with open(source) as f:
+                lexicon = ccg.load_lexicon(f, disk_cache=self.cache)
+            self.assertEqual(repr(lexicon), repr(ccg.load_lexicon(code)))
+            self.assertEqual(len(lexicon.lookup('saw')), n + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,302 @@
+"""
+Tests for :mod:`robiphora.ccg`.
+
+Run with::
+
+    $ python -m unittest discover tests
+"""
+import json
+import random
+import unittest
+import robiphora.ccg as ccg
+from robiphora import synth
+from robiphora.opdl import KnowledgeBase
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NP = ccg.intern_type(ccg.Type('NP'))
+
+
+def workload(seed, words=5):
+    rng = random.Random(seed)
+    code, levels = synth.type_hierarchy(rng, 3, 3)
+    kb = KnowledgeBase(code)
+    types = list(kb.types)
+    pccg, vocabulary = synth.lexicon(rng, words, rng.randint(1, 3), types)
+    lexicon = ccg.Lexicon(ccg.parse(ccg.lex(pccg)))
+    return rng, kb, types, lexicon, vocabulary
+
+
+def cells(cell):
+    return [(typ, [(repr(item.production()), item.prob) for item in items])
+            for typ, items in cell.items()]
+
+
+def parses(results):
+    return [(typ, repr(production), p) for typ, production, p in results]
+
+
+def items(cell):
+    return {typ: sorted(item.prob for item in items)
+            for typ, items in cell.items()}
+
+
+SAW = """
+saw:=(S\\NP)/NP[outside 0.9, 0.1]:λy.λx.see(x,y)
+saw:=(S\\NP)/NP[workshop 0.9, 0.1]:λy.λx.cut(x,y)
+Saw:=N:saw()
+wood:=NP:wood()
+"""
+
+
+class TestLexicon(unittest.TestCase):
+    def test_lookup(self):
+        definitions = list(ccg.parse(ccg.lex(SAW)))
+        lexicon = ccg.Lexicon(definitions)
+        self.assertEqual(len(lexicon), 4)
+        self.assertEqual(lexicon.lookup('saw'), definitions[:2])
+        self.assertEqual(lexicon.lookup('Saw'), definitions[2:3])
+        self.assertEqual(lexicon.lookup('nothing'), [])
+        for word in ('saw', 'Saw', 'wood', 'nothing'):
+            self.assertEqual(lexicon.lookup(word),
+                             ccg.find_word_in_lexicon(word, definitions))
+
+    def test_casefold(self):
+        definitions = list(ccg.parse(ccg.lex(SAW)))
+        lexicon = ccg.Lexicon(definitions, casefold=True)
+        for word in ('saw', 'Saw', 'SAW'):
+            self.assertEqual(lexicon.lookup(word), definitions[:3])
+
+    def test_add_remove(self):
+        definitions = list(ccg.parse(ccg.lex(SAW)))
+        lexicon = ccg.Lexicon()
+        for d in definitions:
+            lexicon.add(d)
+        self.assertEqual(list(lexicon), definitions)
+        lexicon.remove(definitions[0])
+        self.assertEqual(lexicon.lookup('saw'), definitions[1:2])
+        lexicon.remove(definitions[1])
+        self.assertEqual(lexicon.lookup('saw'), [])
+        self.assertNotIn('saw', lexicon.index)
+        with self.assertRaises(ValueError):
+            lexicon.remove(definitions[1])
+        with self.assertRaises(TypeError):
+            lexicon.add('saw')
+
+
+class TestTable(unittest.TestCase):
+    def setUp(self):
+        self.kb = KnowledgeBase('(type outside)\n(type workshop)\n'
+                                '(type shed)\n')
+        self.lexicon = ccg.load_lexicon(SAW)
+
+    def assertFresh(self, context):
+        # The table matches probabilities computed from scratch
+        table = self.lexicon.table(context, self.kb)
+        self.assertEqual(
+            {word: [(d, p) for d, p in scored]
+             for word, scored in table.items()},
+            {self.lexicon.key(d.word): [
+                (e, e.probability(context, self.kb))
+                for e in self.lexicon.lookup(d.word)]
+             for d in self.lexicon})
+        return table
+
+    def probabilities(self, word, context):
+        return [p for _, p in self.lexicon.lookup_scored(word, context,
+                                                         self.kb)]
+
+    def test_reused(self):
+        table = self.assertFresh('shed')
+        self.assertIs(self.lexicon.table('shed', self.kb), table)
+        self.assertIsNot(self.lexicon.table('outside', self.kb), table)
+        self.assertIs(self.lexicon.table('shed', self.kb), table)
+
+    def test_types_change(self):
+        self.assertFresh('shed')
+        self.assertEqual(self.probabilities('saw', 'shed'), [0.1, 0.1])
+        self.kb.add_type('shed', bases=['workshop'])
+        self.assertFresh('shed')
+        self.assertEqual(self.probabilities('saw', 'shed'),
+                         [0.1, 0.9 * 0.9])
+
+    def test_other_knowledge_base(self):
+        self.assertEqual(self.probabilities('saw', 'shed'), [0.1, 0.1])
+        self.kb = KnowledgeBase('(type workshop)\n'
+                                '(type shed :bases (workshop))\n'
+                                '(type outside)\n')
+        self.assertFresh('shed')
+        self.assertEqual(self.probabilities('saw', 'shed'),
+                         [0.1, 0.9 * 0.9])
+
+    def test_lexicon_changes(self):
+        self.assertFresh('outside')
+        see, cut = self.lexicon.lookup('saw')
+        self.lexicon.remove(see)
+        self.assertFresh('outside')
+        self.assertEqual(self.probabilities('saw', 'outside'), [0.1])
+        self.lexicon.add(see)
+        self.assertFresh('outside')
+        self.assertEqual(self.probabilities('saw', 'outside'), [0.1, 0.9])
+
+    def test_no_context(self):
+        self.assertEqual(self.probabilities('saw', None), [1.0, 1.0])
+
+
+class TestPrune(unittest.TestCase):
+    def setUp(self):
+        self.cell = {
+            ccg.S: [ccg.ChartItem(ccg.S, p) for p in (0.1, 0.5, 0.3, 0.02)],
+            NP: [ccg.ChartItem(NP, p) for p in (0.4, 0.04)],
+        }
+
+    def test_beam(self):
+        ccg.prune(self.cell, beam=2)
+        self.assertEqual(items(self.cell),
+                         {ccg.S: [0.3, 0.5], NP: [0.04, 0.4]})
+
+    def test_threshold(self):
+        # Relative to the best item in the whole cell, 0.5
+        ccg.prune(self.cell, threshold=0.1)
+        self.assertEqual(items(self.cell),
+                         {ccg.S: [0.1, 0.3, 0.5], NP: [0.4]})
+
+    def test_threshold_drops_categories(self):
+        ccg.prune(self.cell, threshold=0.9)
+        self.assertEqual(items(self.cell), {ccg.S: [0.5]})
+
+    def test_beam_and_threshold(self):
+        ccg.prune(self.cell, beam=1, threshold=0.5)
+        self.assertEqual(items(self.cell), {ccg.S: [0.5], NP: [0.4]})
+
+    def test_no_limits(self):
+        before = items(self.cell)
+        ccg.prune(self.cell)
+        self.assertEqual(items(self.cell), before)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            ccg.fill_chart([], [], None, beam=0)
+        with self.assertRaises(ValueError):
+            ccg.fill_chart([], [], None, threshold=2)
+
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class TestContexts(unittest.TestCase):
+    def test_matches_chartparse(self):
+        for seed in range(5):
+            rng, kb, types, lexicon, vocabulary = workload(seed)
+            for _ in range(3):
+                words = synth.sentence(rng, vocabulary, rng.choice((5, 8)))
+                contexts = rng.sample(types, 3)
+                parses = ccg.chartparse_contexts(words, lexicon, kb,
+                                                 contexts)
+                for context in contexts:
+                    expected = ccg.chartparse(words, lexicon, kb, context)
+                    self.assertEqual(parses is False, expected is False)
+                    if expected is False:
+                        continue
+                    self.assertEqual(
+                        [(repr(production), probabilities[context])
+                         for _, production, probabilities in parses],
+                        [(repr(production), p)
+                         for _, production, p in expected])
+
+
+class TestIncremental(unittest.TestCase):
+    def test_matches_fill_chart(self):
+        for seed in range(5):
+            rng, kb, types, lexicon, vocabulary = workload(seed)
+            words = synth.sentence(rng, vocabulary, 8)
+            context = rng.choice(types)
+            for beam in (None, 2):
+                parser = ccg.IncrementalParser(lexicon, kb, context,
+                                               beam=beam)
+                for n, word in enumerate(words, 1):
+                    parser.feed(word)
+                    chart = ccg.fill_chart(words[:n], lexicon, kb, context,
+                                           beam=beam)
+                    self.assertEqual(set(parser.chart), set(chart))
+                    for key in chart:
+                        self.assertEqual(cells(parser.chart[key]),
+                                         cells(chart[key]))
+
+    def test_best_spans(self):
+        rng, kb, types, lexicon, vocabulary = workload(0)
+        words = synth.sentence(rng, vocabulary, 5)
+        parser = ccg.IncrementalParser(lexicon, kb, types[0])
+        for n, word in enumerate(words, 1):
+            parser.feed(word)
+            # The spans cover the words so far, in order
+            end = 0
+            for i, length, *_ in parser.best_spans():
+                self.assertEqual(i, end)
+                end += length
+            self.assertEqual(end, n)
+        self.assertEqual(len(parser.best_spans()), 1)
+        self.assertEqual(parses(parser.parses()),
+                         parses(ccg.chartparse(words, lexicon, kb,
+                                               types[0])))
+        parser.reset()
+        self.assertEqual((parser.words, parser.parses(),
+                          parser.best_spans()), ([], [], []))
+
+
+class TestAgenda(unittest.TestCase):
+    def test_matches_kbest(self):
+        for seed in range(10):
+            rng, kb, types, lexicon, vocabulary = workload(seed)
+            for _ in range(3):
+                words = synth.sentence(rng, vocabulary, rng.choice((5, 8)))
+                context = rng.choice(types + [None])
+                found = list(ccg.agenda_kbest(words, lexicon, kb, context))
+                self.assertEqual(
+                    sorted(parses(found)),
+                    sorted(parses(ccg.kbest(words, lexicon, kb, context))))
+                self.assertEqual(
+                    [p for *_, p in found],
+                    sorted((p for *_, p in found), reverse=True))
+
+    def test_k(self):
+        rng, kb, types, lexicon, vocabulary = workload(1)
+        words = synth.sentence(rng, vocabulary, 8)
+        found = parses(ccg.agenda_kbest(words, lexicon, kb, types[0]))
+        for k in (0, 1, 2):
+            self.assertEqual(
+                parses(ccg.agenda_kbest(words, lexicon, kb, types[0], k)),
+                found[:k])
+
+    def test_unknown_word(self):
+        rng, kb, types, lexicon, vocabulary = workload(0)
+        self.assertEqual(
+            list(ccg.agenda_kbest(['nothing'], lexicon, kb, types[0])), [])
+
+
+class TestBatch(unittest.TestCase):
+    def test_jobs_keep_order(self):
+        rng, kb, types, lexicon, vocabulary = workload(2)
+        lines = [' '.join(synth.sentence(rng, vocabulary, rng.choice((5, 8))))
+                 for _ in range(40)]
+        # Lines which fail and lines with no parse are kept in place too
+        lines[3] = 'nothing parses this'
+        lines[7] = ''
+        serial = list(ccg.batch_parse(lines, lexicon, kb, types[0]))
+        self.assertEqual([json.loads(r)['line'] for r in serial], lines)
+        self.assertIsNone(json.loads(serial[3])['parses'])
+        for jobs, chunk_size in ((2, 1), (3, 7)):
+            self.assertEqual(
+                list(ccg.batch_parse(lines, lexicon, kb, types[0],
+                                     jobs=jobs, chunk_size=chunk_size)),
+                serial)
+
+    def test_table_filled_before_forking(self):
+        rng, kb, types, lexicon, vocabulary = workload(2)
+        list(ccg.batch_parse([], lexicon, kb, types[0], jobs=2))
+        self.assertIn(types[0], lexicon._tables)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+"""
+Tests for :mod:`robiphora.nlp`.
+
+Run with::
+
+    $ python -m unittest discover tests
+"""
+import json
+import unittest
+import robiphora.ccg as ccg
+from robiphora.nlp import parse_record
+from robiphora.opdl import KnowledgeBase
+
+
+class TestParseRecord(unittest.TestCase):
+    def test_impossible_parse(self):
+        kb = KnowledgeBase('(type workshop)\n'
+                           '(type house :antibases (workshop))\n')
+        lexicon = ccg.load_lexicon('saw:=S[workshop 0.5, 0]:saw()\n')
+        for context, logprob in (('house', None), ('workshop', -0.693147)):
+            record = parse_record(ccg.kbest(['saw'], lexicon, kb, context))
+            # Infinities would be written as invalid JSON
+            text = json.dumps(record, allow_nan=False)
+            self.assertEqual(len(json.loads(text)), 1)
+            if logprob is None:
+                self.assertIsNone(record[0]['logprob'])
+            else:
+                self.assertAlmostEqual(record[0]['logprob'], logprob, 6)
+            self.assertEqual(record[0]['semantics'], 'saw()')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,431 @@
+"""
+Tests for :mod:`robiphora.opdl`.
+
+Run with::
+
+    $ python -m unittest discover tests
+"""
+import io
+import operator
+import os
+import random
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+import robiphora.opdl as opdl
+from robiphora import synth
+from robiphora.opdl import (match, CompleteExpression, KeywordArgName,
+                            KeywordArg, PartialSE, LParen, SExpression,
+                            KnowledgeBase, QueryCache)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+here = os.path.dirname(os.path.abspath(__file__))
+examples = os.path.join(here, os.pardir, 'examples')
+
+PIECES = ('(', ')', 'a', 'bb', ':k', ':j', '"s t"', '"q\\"x"', ' ', '\n',
+          '; c\n', "'", '"open')
+
+
+def shift_reduce_separse(tokens):
+    # The match()-driven parser which separse replaced
+    tokens = iter(tokens)
+    stack = []
+    while True:
+        if match(stack, [KeywordArgName, CompleteExpression]):
+            e, k = (stack.pop() for _ in range(2))
+            stack.append(KeywordArg(k.name, e))
+        elif match(stack, [KeywordArg, PartialSE]):
+            e, k = (stack.pop() for _ in range(2))
+            if e.args:
+                raise SyntaxError('keywords must come at end of expression')
+            if k.name in e.kwargs.keys():
+                raise SyntaxError('{} defined twice'.format(k.name))
+            e.kwargs[k.name] = k.value
+            stack.append(e)
+        elif match(stack, [CompleteExpression, PartialSE]):
+            e, s = (stack.pop() for _ in range(2))
+            e.args.append(s)
+            stack.append(e)
+        elif match(stack, [LParen, PartialSE]):
+            e, p = (stack.pop() for _ in range(2))
+            stack.append(SExpression(e.args[::-1], e.kwargs))
+        elif len(stack) == 1 and isinstance(stack[0], SExpression):
+            yield stack.pop()
+        else:
+            try:
+                stack.append(next(tokens))
+            except StopIteration:
+                break
+    if stack:
+        raise SyntaxError('parse error')
+
+
+def read_opdl(code, chunk_size=None, separse=opdl.separse):
+    try:
+        if chunk_size is None:
+            tokens = opdl.lex(code)
+        else:
+            tokens = opdl.lex(io.StringIO(code), chunk_size)
+        return [repr(se) for se in separse(tokens)]
+    except SyntaxError as e:
+        return 'SyntaxError: {}'.format(e)
+
+
+def random_opdl(rng):
+    return ''.join(rng.choice(PIECES) + rng.choice(('', ' '))
+                   for _ in range(rng.randint(0, 14)))
+
+
+class TestReader(unittest.TestCase):
+    def test_matches_shift_reduce(self):
+        rng = random.Random(1)
+        for _ in range(30000):
+            code = random_opdl(rng)
+            self.assertEqual(read_opdl(code),
+                             read_opdl(code, separse=shift_reduce_separse),
+                             code)
+
+    def test_chunked_matches_whole_input(self):
+        rng = random.Random(0)
+        for _ in range(30000):
+            code = random_opdl(rng)
+            self.assertEqual(read_opdl(code, rng.randint(1, 9)),
+                             read_opdl(code), code)
+
+    def test_example(self):
+        with open(os.path.join(examples, 'world.opdl')) as f:
+            code = f.read()
+        self.assertEqual(read_opdl(code, 5), read_opdl(code))
+        self.assertEqual(read_opdl(code),
+                         read_opdl(code, separse=shift_reduce_separse))
+
+
+HIERARCHY = '''
+(type thing)
+(type tool :bases (thing))
+(type saw :bases (tool))
+(type animal :antibases (tool))
+'''
+
+
+def full_scan(kb, baseset, k=None):
+    # Every object of kb scored with query_is, as resolve ranks them
+    ranked = sorted(
+        ((o.name, reduce(operator.mul,
+                         (max(kb.query_is(t, b) for t in o.types)
+                          for b in baseset)))
+         for o in kb.objects.values()),
+        key=lambda x: -x[1])
+    return ranked[:k]
+
+
+def resolved(kb, baseset, k=None):
+    return [(o.name, p) for o, p in kb.resolve(baseset, k)]
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = QueryCache(2)
+        self.assertEqual(cache.lookup('a', lambda: 1), 1)
+        self.assertEqual(cache.lookup('b', lambda: 2), 2)
+        # Using a makes b the least recently used
+        self.assertEqual(cache.lookup('a', lambda: None), 1)
+        self.assertEqual(cache.lookup('c', lambda: 3), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.lookup('a', lambda: None), 1)
+        self.assertEqual(cache.lookup('b', lambda: 4), 4)
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+    def test_maxsize(self):
+        with self.assertRaises(ValueError):
+            QueryCache(0)
+
+    def test_matches_uncached(self):
+        kb = KnowledgeBase(HIERARCHY, cache_size=3)
+        uncached = KnowledgeBase(HIERARCHY, cache_size=0)
+        for _ in range(2):
+            for a in kb.types:
+                for b in kb.types:
+                    self.assertEqual(kb.query_is(a, b),
+                                     uncached.query_is(a, b))
+        self.assertEqual(len(kb.query_cache), 3)
+
+    def test_cleared_when_types_change(self):
+        kb = KnowledgeBase(HIERARCHY)
+        self.assertAlmostEqual(kb.query_is('saw', 'thing'), 0.81)
+        self.assertEqual(len(kb.query_cache), 1)
+        kb.add_type('saw', bases=['thing'])
+        self.assertEqual(len(kb.query_cache), 0)
+        self.assertAlmostEqual(kb.query_is('saw', 'thing'), 0.9)
+        kb.add_type('plant')
+        self.assertEqual(len(kb.query_cache), 0)
+
+
+def best_paths(kb):
+    # The fixed point TypeMatrix describes, computed one pair at a time
+    names = list(kb.types)
+    p = {(a, b): float(a == b) for a in names for b in names}
+    while True:
+        new = {}
+        for a in names:
+            t = kb.types[a]
+            for b in names:
+                if a == b:
+                    new[a, b] = 1.0
+                elif b in t.antibases:
+                    new[a, b] = 0.0
+                else:
+                    new[a, b] = max(
+                        [0.9 * p[c, b] for c in t.bases if c in kb.types]
+                        + [0.1 * p[c, b] for c in names if c != a])
+        if new == p:
+            return p
+        p = new
+
+
+def random_worlds(seeds):
+    for seed in seeds:
+        rng = random.Random(seed)
+        code, levels = synth.type_hierarchy(
+            rng, rng.randint(1, 3), rng.randint(1, 3), antibase_rate=0.4,
+            extra_base_rate=0.3, objects=rng.randint(0, 10))
+        yield rng, KnowledgeBase(code)
+
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class TestTypeMatrix(unittest.TestCase):
+    def test_best_paths(self):
+        for rng, kb in random_worlds(range(20)):
+            matrix = kb.compile()
+            for (a, b), p in best_paths(kb).items():
+                self.assertAlmostEqual(matrix.query_is(a, b), p, 12)
+
+    def test_matches_query_is(self):
+        # In these worlds a second base is always a type one level up, so
+        # the fallback search of query_is never cuts a path short
+        for rng, kb in random_worlds(range(20)):
+            matrix = kb.compile()
+            for a in kb.types:
+                for b in kb.types:
+                    self.assertAlmostEqual(matrix.query_is(a, b),
+                                           kb.query_is(a, b), 12)
+
+    def test_score_objects(self):
+        for rng, kb in random_worlds(range(20)):
+            matrix = kb.compile()
+            types = list(kb.types)
+            for _ in range(5):
+                baseset = set(rng.sample(types, min(len(types), 2)))
+                scores = matrix.score_objects(baseset)
+                self.assertEqual(len(scores), len(kb.objects))
+                for obj, p in zip(matrix.objects, scores):
+                    self.assertAlmostEqual(float(p),
+                                           kb.score(obj, baseset), 12)
+
+    def test_fallback_cuts_query_is_short(self):
+        # jill is a woman (so animate, through female and human) and short.
+        # If query_is tries short first, finding no base path it falls back
+        # to every other type, visiting female and human on the way, so the
+        # path through woman is cut short.  Which base is tried first
+        # depends on the string hash seed, while the matrix always finds
+        # the path.
+        with open(os.path.join(examples, 'home.opdl')) as f:
+            kb = KnowledgeBase(f)
+        matrix = kb.compile()
+        self.assertAlmostEqual(matrix.query_is('jill', 'animate'), 0.9 ** 4)
+        self.assertIn(round(kb.query_is('jill', 'animate'), 12),
+                      (round(0.9 ** 4, 12), 0.1))
+        for a in kb.types:
+            for b in kb.types:
+                self.assertLessEqual(kb.query_is(a, b),
+                                     matrix.query_is(a, b) + 1e-12)
+
+    def test_empty(self):
+        kb = KnowledgeBase('')
+        matrix = kb.compile()
+        self.assertEqual(matrix.p.shape, (0, 0))
+        self.assertEqual(len(matrix.score_objects(set())), 0)
+        kb.add_type('tool')
+        kb.add_object('saw', ['tool'])
+        self.assertEqual(list(kb.compile().score_objects({'tool'})), [1.0])
+
+
+class TestResolve(unittest.TestCase):
+    def test_matches_full_scan(self):
+        for seed in range(12):
+            rng = random.Random(seed)
+            code, levels = synth.type_hierarchy(
+                rng, rng.randint(1, 3), rng.randint(1, 3),
+                antibase_rate=0.4, extra_base_rate=0.3,
+                objects=rng.randint(1, 20))
+            kb = KnowledgeBase(code)
+            types = list(kb.types)
+            for _ in range(10):
+                names = list(kb.objects)
+                if names and rng.random() < 0.3:
+                    kb.update_object(rng.choice(names),
+                                     rng.sample(types, 1))
+                elif rng.random() < 0.3:
+                    kb.add_object(rng.choice(('zz', 'zy')),
+                                  rng.sample(types, 1))
+                baseset = set(rng.sample(types, min(len(types), 2)))
+                for k in (None, 1, 3):
+                    self.assertEqual(resolved(kb, baseset, k),
+                                     full_scan(kb, baseset, k))
+
+    def test_k(self):
+        kb = KnowledgeBase(HIERARCHY + "(object s :type (saw))\n")
+        for k in (0, -1):
+            with self.assertRaises(ValueError):
+                kb.resolve({'tool'}, k)
+        self.assertEqual(resolved(kb, {'tool'}, 5), full_scan(kb, {'tool'}))
+
+
+class TestMutation(unittest.TestCase):
+    def setUp(self):
+        self.kb = KnowledgeBase(HIERARCHY + """
+            (type hammer :bases (tool) :nouns ("hammer"))
+            (object h :type (hammer))
+            (object s :type (saw))
+            (object a :type (animal))
+        """)
+
+    def assertResolves(self, *basesets):
+        for baseset in basesets:
+            for k in (None, 1, 2):
+                self.assertEqual(resolved(self.kb, baseset, k),
+                                 full_scan(self.kb, baseset, k))
+
+    def test_redefine_type(self):
+        kb = self.kb
+        self.assertResolves({'tool'})
+        index = kb.object_index
+        kb.add_type('hammer', bases=['tool'], nouns=['mallet'])
+        # The bases did not change, so neither did the index
+        self.assertIs(kb.object_index, index)
+        self.assertEqual(kb.baserefs['nouns']['mallet'], {'hammer'})
+        self.assertNotIn('hammer', kb.baserefs['nouns'])
+        self.assertEqual(kb.types['hammer'].nouns, {'mallet'})
+        self.assertResolves({'tool'}, {'hammer'})
+
+    def test_redefine_type_drops_references(self):
+        kb = self.kb
+        kb.add_type('saw')
+        self.assertNotIn('saw', kb.baserefs['bases']['tool'])
+        kb.add_type('animal')
+        self.assertNotIn('tool', kb.baserefs.get('antibases', {}))
+
+    def test_change_bases_of_indexed_type(self):
+        kb = self.kb
+        self.assertResolves({'tool'}, {'thing'})
+        kb.add_type('saw', bases=['animal'])
+        self.assertResolves({'tool'}, {'thing'}, {'animal'})
+        kb.add_type('tool')
+        self.assertResolves({'tool'}, {'thing'}, {'animal'})
+
+    def test_change_bases_of_unindexed_type(self):
+        kb = self.kb
+        kb.add_type('plant')
+        kb.add_type('tree', bases=['plant'])
+        self.assertResolves({'plant'}, {'thing'})
+        index = kb.object_index
+        kb.add_type('tree', bases=['thing'])
+        # No object has the type, so the index is kept
+        self.assertIs(kb.object_index, index)
+        kb.add_object('oak', ['tree'])
+        self.assertResolves({'plant'}, {'thing'}, {'tree'})
+
+    def test_change_objects(self):
+        kb = self.kb
+        self.assertResolves({'tool'})
+        kb.update_object('a', ['saw'])
+        kb.add_object('t', ['thing'])
+        kb.remove_object('h')
+        self.assertResolves({'tool'}, {'animal'}, {'thing'})
+
+    def test_remove_type(self):
+        kb = self.kb
+        for name in ('tool', 'saw', 'hammer', 'animal'):
+            with self.assertRaises(ValueError):
+                kb.remove_type(name)
+        kb.remove_object('h')
+        self.assertResolves({'hammer'}, {'tool'})
+        kb.remove_type('hammer')
+        self.assertNotIn('hammer', kb.types)
+        self.assertNotIn('hammer', kb.baserefs['nouns'])
+        self.assertNotIn('hammer', kb.baserefs['bases']['tool'])
+        self.assertResolves({'tool'}, {'thing'})
+        with self.assertRaises(KeyError):
+            kb.remove_type('hammer')
+
+
+class TestImports(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def write(self, files):
+        for name, code in files.items():
+            path = os.path.join(self.directory, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(code)
+
+    def load(self, name, executor=None):
+        with open(os.path.join(self.directory, name)) as f:
+            return KnowledgeBase(f, executor=executor)
+
+    def assertSameKB(self, kb, other):
+        self.assertEqual(repr(list(kb.types.values())),
+                         repr(list(other.types.values())))
+        self.assertEqual(repr(list(kb.objects.values())),
+                         repr(list(other.objects.values())))
+        self.assertEqual(kb.loaded, other.loaded)
+
+    def assertLoadsAlike(self, name):
+        kb = self.load(name)
+        with ThreadPoolExecutor(3) as executor:
+            self.assertSameKB(self.load(name, executor), kb)
+        return kb
+
+    def test_diamond(self):
+        # b and c both import d, which is only loaded (by b) once: c's
+        # definition of x comes after d's either way
+        self.write({
+            'a.opdl': '(import "b.opdl")\n(import "sub/c.opdl")\n'
+                      '(type a :bases (b c))\n',
+            'b.opdl': '(import "d.opdl")\n(type b :bases (d))\n',
+            'sub/c.opdl': '(import "../d.opdl")\n(type c :bases (d))\n'
+                          '(object x :type (c))\n',
+            'd.opdl': '(type d)\n(object x :type (d))\n',
+        })
+        kb = self.assertLoadsAlike('a.opdl')
+        self.assertEqual(list(kb.types), ['d', 'b', 'c', 'a'])
+        self.assertEqual(kb.objects['x'].types, {'c'})
+        self.assertEqual(len(kb.loaded), 4)
+
+    def test_cycle(self):
+        self.write({
+            'a.opdl': '(import "b.opdl")\n(type a)\n',
+            'b.opdl': '(import "c.opdl")\n(type b)\n',
+            'c.opdl': '(import "a.opdl")\n(import "c.opdl")\n(type c)\n',
+        })
+        kb = self.assertLoadsAlike('a.opdl')
+        self.assertEqual(list(kb.types), ['c', 'b', 'a'])
+
+    def test_example(self):
+        with open(os.path.join(examples, 'home.opdl')) as f:
+            kb = KnowledgeBase(f)
+        with open(os.path.join(examples, 'home.opdl')) as f:
+            with ThreadPoolExecutor(2) as executor:
+                self.assertSameKB(KnowledgeBase(f, executor=executor), kb)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Tests for :mod:`robiphora.server`.
+
+Run with::
+
+    $ python -m unittest discover tests
+"""
+import asyncio
+import json
+import socket
+import struct
+import unittest
+import robiphora.ccg as ccg
+from robiphora.opdl import KnowledgeBase
+from robiphora.server import Server
+
+LEXICON = """
+saw:=(S\\NP)/NP[outside 0.9, 0.1]:λy.λx.see(x,y)
+I:=NP:I()
+wood:=NP:wood()
+"""
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        kb = KnowledgeBase('(type outside)\n(type workshop)\n')
+        self.server = Server(kb, ccg.load_lexicon(LEXICON), workers=1)
+        self.addCleanup(self.server.parse_pool.shutdown)
+        self.addCleanup(self.server.resolve_pool.shutdown)
+
+    def exchange(self, lines):
+        # Send every line at once over a real socket and read the
+        # responses in the order they arrive
+        async def run():
+            server = await asyncio.start_server(self.server.handle,
+                                                '127.0.0.1', 0)
+            async with server:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                               port)
+                writer.write(''.join(line + '\n' for line in lines)
+                             .encode('utf-8'))
+                writer.write_eof()
+                data = await reader.read()
+                responses = [json.loads(line)
+                             for line in data.decode('utf-8').splitlines()]
+                writer.close()
+                await writer.wait_closed()
+            return responses
+        return asyncio.run(run())
+
+    def test_requests(self):
+        responses = self.exchange([
+            json.dumps({'id': 1, 'op': 'parse', 'text': 'I saw wood',
+                        'context': 'outside'}),
+            json.dumps({'id': 2, 'op': 'parse', 'text': 'I saw wood',
+                        'context': 'nowhere'}),
+            json.dumps({'id': 3, 'op': 'resolve', 'text': 'the wood'}),
+            json.dumps({'id': 4, 'op': 'translate'}),
+            '{"id": 5, "op": ',
+        ])
+        by_id = {response['id']: response for response in responses}
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(set(by_id), {1, 2, 3, 4, None})
+        # Requests answered on the event loop overtake the parses, which
+        # wait for a worker process
+        self.assertEqual({r['id'] for r in responses[:3]}, {3, 4, None})
+        result = by_id[1]['result']
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['semantics'], 'see(I(), wood())')
+        self.assertEqual(by_id[2]['error'], "KeyError: 'nowhere'")
+        self.assertEqual(by_id[3]['error'],
+                         'ValueError: no spaCy pipeline loaded')
+        self.assertEqual(by_id[4]['error'],
+                         "ValueError: unknown op 'translate'")
+        self.assertTrue(by_id[None]['error'].startswith('JSONDecodeError'))
+        for response in responses:
+            self.assertEqual(len(response), 2)
+
+    def test_client_gone(self):
+        # A client which resets the connection before its answer is ready
+        # is not an error
+        async def run():
+            errors = []
+            asyncio.get_running_loop().set_exception_handler(
+                lambda loop, context: errors.append(context))
+            received, reset, done = (asyncio.Event(), asyncio.Event(),
+                                     asyncio.Event())
+
+            async def wait(request):
+                received.set()
+                await reset.wait()
+                return 'too late'
+            self.server.ops['wait'] = wait
+            respond = self.server.respond
+
+            async def recording(*args):
+                # Nothing awaits the tasks which answer requests
+                try:
+                    await respond(*args)
+                except Exception as e:
+                    errors.append(e)
+                    raise
+            self.server.respond = recording
+
+            async def handle(reader, writer):
+                try:
+                    await self.server.handle(reader, writer)
+                finally:
+                    done.set()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            async with server:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                               port)
+                writer.write(b'{"id": 1, "op": "wait"}\n')
+                await received.wait()
+                writer.get_extra_info('socket').setsockopt(
+                    socket.SOL_SOCKET, socket.SO_LINGER,
+                    struct.pack('ii', 1, 0))
+                writer.transport.abort()
+                await asyncio.sleep(0.1)
+                reset.set()
+                await done.wait()
+            return errors
+        self.assertEqual(asyncio.run(run()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()